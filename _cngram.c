@@ -0,0 +1,317 @@
+/*  _cngram.c
+ *  Using Python 3.4.3
+ *
+ *  Optional compiled kernel of cngram.get_cond_cnts. The character n-grams
+ *  of the padded words are hashed as rolling windows over UCS-4 buffers and
+ *  counted in an open-addressing table, so that no substring is created
+ *  until the distinct n-grams are added to the counts at the end.
+ *
+ *  Build it in place with (see README):
+ *
+ *      gcc -O2 -shared -fPIC $(python3-config --includes) _cngram.c \
+ *          -o _cngram$(python3-config --extension-suffix)
+ */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdint.h>
+#include <string.h>
+
+#define HASH_BASE 1000003ULL
+#define MIN_SLOTS 1024
+
+/* The distinct n-grams in order of first occurrence, with an index of
+   slots into them; a slot is -1 when empty. */
+typedef struct {
+    int n;
+    Py_ssize_t size, capacity, num_slots;
+    Py_UCS4 *keys;
+    uint64_t *hashes;
+    Py_ssize_t *counts;
+    Py_ssize_t *slots;
+} Table;
+
+static uint64_t
+mix(uint64_t h)
+{
+    h ^= h >> 33;
+    h *= 0xff51afd7ed558ccdULL;
+    h ^= h >> 33;
+    return h;
+}
+
+static int
+table_init(Table *t, int n)
+{
+    Py_ssize_t i;
+
+    t->n = n;
+    t->size = 0;
+    t->capacity = MIN_SLOTS / 2;
+    t->num_slots = MIN_SLOTS;
+    t->keys = PyMem_Malloc(sizeof(Py_UCS4) * n * t->capacity);
+    t->hashes = PyMem_Malloc(sizeof(uint64_t) * t->capacity);
+    t->counts = PyMem_Malloc(sizeof(Py_ssize_t) * t->capacity);
+    t->slots = PyMem_Malloc(sizeof(Py_ssize_t) * t->num_slots);
+    if (!t->keys || !t->hashes || !t->counts || !t->slots) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    for (i = 0; i < t->num_slots; i++)
+        t->slots[i] = -1;
+    return 0;
+}
+
+static void
+table_free(Table *t)
+{
+    PyMem_Free(t->keys);
+    PyMem_Free(t->hashes);
+    PyMem_Free(t->counts);
+    PyMem_Free(t->slots);
+}
+
+/* Double the slots and the entries, keeping the load factor below 1/2 */
+static int
+table_grow(Table *t)
+{
+    Py_ssize_t i, j, mask, num_slots = t->num_slots * 2;
+    Py_ssize_t capacity = t->capacity * 2;
+    Py_ssize_t *slots;
+    void *p;
+
+    p = PyMem_Realloc(t->keys, sizeof(Py_UCS4) * t->n * capacity);
+    if (!p)
+        goto nomem;
+    t->keys = p;
+    p = PyMem_Realloc(t->hashes, sizeof(uint64_t) * capacity);
+    if (!p)
+        goto nomem;
+    t->hashes = p;
+    p = PyMem_Realloc(t->counts, sizeof(Py_ssize_t) * capacity);
+    if (!p)
+        goto nomem;
+    t->counts = p;
+    t->capacity = capacity;
+
+    slots = PyMem_Malloc(sizeof(Py_ssize_t) * num_slots);
+    if (!slots)
+        goto nomem;
+    for (i = 0; i < num_slots; i++)
+        slots[i] = -1;
+    mask = num_slots - 1;
+    for (i = 0; i < t->size; i++) {
+        j = (Py_ssize_t)(mix(t->hashes[i]) & (uint64_t)mask);
+        while (slots[j] >= 0)
+            j = (j + 1) & mask;
+        slots[j] = i;
+    }
+    PyMem_Free(t->slots);
+    t->slots = slots;
+    t->num_slots = num_slots;
+    return 0;
+
+nomem:
+    PyErr_NoMemory();
+    return -1;
+}
+
+static int
+table_add(Table *t, const Py_UCS4 *gram, uint64_t h)
+{
+    Py_ssize_t mask = t->num_slots - 1;
+    Py_ssize_t j = (Py_ssize_t)(mix(h) & (uint64_t)mask);
+    Py_ssize_t entry;
+    size_t key_size = sizeof(Py_UCS4) * t->n;
+
+    while ((entry = t->slots[j]) >= 0) {
+        if (t->hashes[entry] == h &&
+                memcmp(t->keys + entry * t->n, gram, key_size) == 0) {
+            t->counts[entry]++;
+            return 0;
+        }
+        j = (j + 1) & mask;
+    }
+
+    entry = t->size++;
+    memcpy(t->keys + entry * t->n, gram, key_size);
+    t->hashes[entry] = h;
+    t->counts[entry] = 1;
+    t->slots[j] = entry;
+    if (t->size == t->capacity)
+        return table_grow(t);
+    return 0;
+}
+
+/* Count the n-grams of one word, padded with n - 1 spaces on each side */
+static int
+count_word(Table *t, PyObject *word, Py_UCS4 **buffer, Py_ssize_t *buffer_size,
+           uint64_t top)
+{
+    int n = t->n, kind;
+    void *data;
+    Py_ssize_t i, length, padded;
+    Py_UCS4 *chars;
+    uint64_t h = 0;
+
+    if (!PyUnicode_Check(word)) {
+        PyErr_Format(PyExc_TypeError, "words must be str, not %.200s",
+                     Py_TYPE(word)->tp_name);
+        return -1;
+    }
+#if PY_VERSION_HEX < 0x030C0000
+    if (PyUnicode_READY(word) < 0)
+        return -1;
+#endif
+    kind = PyUnicode_KIND(word);
+    data = PyUnicode_DATA(word);
+    length = PyUnicode_GET_LENGTH(word);
+    padded = length + 2 * (n - 1);
+
+    if (padded > *buffer_size) {
+        chars = PyMem_Realloc(*buffer, sizeof(Py_UCS4) * padded);
+        if (!chars) {
+            PyErr_NoMemory();
+            return -1;
+        }
+        *buffer = chars;
+        *buffer_size = padded;
+    }
+    chars = *buffer;
+    for (i = 0; i < n - 1; i++)
+        chars[i] = chars[padded - 1 - i] = ' ';
+    for (i = 0; i < length; i++)
+        chars[n - 1 + i] = PyUnicode_READ(kind, data, i);
+
+    for (i = 0; i < padded; i++) {
+        /* Roll the window: drop the character n places back */
+        if (i >= n)
+            h -= top * chars[i - n];
+        h = h * HASH_BASE + chars[i];
+        if (i >= n - 1 && table_add(t, chars + i - n + 1, h) < 0)
+            return -1;
+    }
+    return 0;
+}
+
+/* Add the counts of the table to cond_cnts[ctx][lastc] */
+static int
+table_emit(Table *t, PyObject *cond_cnts)
+{
+    Py_ssize_t i;
+    int n = t->n;
+
+    for (i = 0; i < t->size; i++) {
+        const Py_UCS4 *gram = t->keys + i * n;
+        PyObject *ctx, *lastc, *cnts, *old, *count;
+        int err;
+
+        ctx = PyUnicode_FromKindAndData(PyUnicode_4BYTE_KIND, gram, n - 1);
+        if (!ctx)
+            return -1;
+        cnts = PyObject_GetItem(cond_cnts, ctx);
+        Py_DECREF(ctx);
+        if (!cnts)
+            return -1;
+        if (!PyDict_Check(cnts)) {
+            PyErr_SetString(PyExc_TypeError,
+                            "cond_cnts must map contexts to dicts");
+            Py_DECREF(cnts);
+            return -1;
+        }
+
+        lastc = PyUnicode_FromKindAndData(PyUnicode_4BYTE_KIND,
+                                          gram + n - 1, 1);
+        if (!lastc) {
+            Py_DECREF(cnts);
+            return -1;
+        }
+        old = PyDict_GetItemWithError(cnts, lastc);
+        if (old) {
+            PyObject *add = PyLong_FromSsize_t(t->counts[i]);
+            count = add ? PyNumber_Add(old, add) : NULL;
+            Py_XDECREF(add);
+        }
+        else if (PyErr_Occurred())
+            count = NULL;
+        else
+            count = PyLong_FromSsize_t(t->counts[i]);
+        err = count ? PyDict_SetItem(cnts, lastc, count) : -1;
+        Py_XDECREF(count);
+        Py_DECREF(lastc);
+        Py_DECREF(cnts);
+        if (err < 0)
+            return -1;
+    }
+    return 0;
+}
+
+PyDoc_STRVAR(count_ngrams_doc,
+"count_ngrams(cond_cnts, words, n)\n\
+\n\
+Add the character n-gram counts of words to cond_cnts, a\n\
+defaultdict(Counter) from contexts to last characters, in the same\n\
+order as cngram.get_cond_cnts would.");
+
+static PyObject *
+count_ngrams(PyObject *self, PyObject *args)
+{
+    PyObject *cond_cnts, *words, *iterator, *word;
+    int n, i;
+    Table table;
+    Py_UCS4 *buffer = NULL;
+    Py_ssize_t buffer_size = 0;
+    uint64_t top = 1;
+
+    if (!PyArg_ParseTuple(args, "OOi:count_ngrams", &cond_cnts, &words, &n))
+        return NULL;
+    if (n < 1) {
+        PyErr_SetString(PyExc_ValueError, "n must be at least 1");
+        return NULL;
+    }
+    iterator = PyObject_GetIter(words);
+    if (!iterator)
+        return NULL;
+    if (table_init(&table, n) < 0) {
+        table_free(&table);
+        Py_DECREF(iterator);
+        return NULL;
+    }
+    for (i = 1; i < n; i++)
+        top *= HASH_BASE;
+
+    while ((word = PyIter_Next(iterator))) {
+        int err = count_word(&table, word, &buffer, &buffer_size, top);
+        Py_DECREF(word);
+        if (err < 0)
+            break;
+    }
+    Py_DECREF(iterator);
+    PyMem_Free(buffer);
+
+    if (PyErr_Occurred() || table_emit(&table, cond_cnts) < 0) {
+        table_free(&table);
+        return NULL;
+    }
+    table_free(&table);
+    Py_RETURN_NONE;
+}
+
+static PyMethodDef cngram_methods[] = {
+    {"count_ngrams", count_ngrams, METH_VARARGS, count_ngrams_doc},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef cngram_module = {
+    PyModuleDef_HEAD_INIT,
+    "_cngram",
+    "Compiled n-gram counting kernel of cngram.get_cond_cnts.",
+    -1,
+    cngram_methods
+};
+
+PyMODINIT_FUNC
+PyInit__cngram(void)
+{
+    return PyModule_Create(&cngram_module);
+}
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+#  benchmark.py
+#  Using Python 3.4.3
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import itertools
+import collections
+import subprocess
+import tracemalloc
+from bisect import bisect
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+import cngram
+from cngram import CNGram, get_cond_cnts
+from cs_model import CodeSModel
+from hmm import HiddenMarkovModel
+from lexicon import build_lexicon
+from tokenizer import split_words
+
+
+"""Letters of the two synthetic languages. They overlap, as English and
+    Spanish do, so that language identification is not trivial.
+"""
+LANG1_ALPHABET = "etaoinshrdlcumwfgypbvkjxqz"
+LANG2_ALPHABET = "eaosrnidlctumpbgvyqhfzjñáéíóú"
+TAGS = ["Lang1", "Lang2"]
+
+
+def synthetic_words(num_words, alphabet="abcdefghijklmnopqrstuvwxyz",
+                    seed=0):
+    """Generate a reproducible list of random words with Zipf-like reuse.
+
+    Args:
+        num_words (int): number of tokens to generate
+        alphabet (str, optional): characters to draw from
+        seed (int, optional): random seed
+
+    Returns:
+        list<str>: the generated tokens
+    """
+    rng = random.Random(seed)
+    weights = [1.0 / (rank + 1) for rank in range(len(alphabet))]
+    vocab = ["".join(weighted_choices(rng, alphabet, weights,
+                                      rng.randint(1, 10)))
+             for _ in range(max(1, num_words // 10))]
+    weights = [1.0 / (rank + 1) for rank in range(len(vocab))]
+    return weighted_choices(rng, vocab, weights, num_words)
+
+
+def weighted_choices(rng, population, weights, k):
+    """Draw k items of population with replacement, each with probability
+        proportional to its weight. Draws the same items as
+        random.Random.choices, which Python 3.4 lacks.
+    """
+    cum_weights = list(itertools.accumulate(weights))
+    total = cum_weights[-1]
+    hi = len(cum_weights) - 1
+    return [population[bisect(cum_weights, rng.random() * total, 0, hi)]
+            for _ in range(k)]
+
+
+class SyntheticCorpus:
+    """Training data for two languages and a code-switched test text,
+        generated locally and reproducibly.
+
+    Args:
+        size (int): Number of tokens of each training corpus and of the text
+        seed (int, optional): Random seed. The default is 0.
+
+    Properties:
+        lang1_words (list<str>): training tokens of the first language
+        lang2_words (list<str>): training tokens of the second language
+        tokens (list<str>): the code-switched text, with punctuation
+        gold_tags (list<str>): the language of each token of the text
+        text (str): the tokens joined by spaces
+    """
+
+    def __init__(self, size, seed=0):
+        self.size = size
+        self.lang1_words = synthetic_words(size, LANG1_ALPHABET, seed)
+        self.lang2_words = synthetic_words(size, LANG2_ALPHABET, seed + 1)
+
+        rng = random.Random(seed + 2)
+        lang1_test = synthetic_words(size, LANG1_ALPHABET, seed + 3)
+        lang2_test = synthetic_words(size, LANG2_ALPHABET, seed + 4)
+        self.tokens, self.gold_tags = [], []
+        lang = 0
+        for k in range(size):
+            if rng.random() < 0.1:
+                self.tokens.append(rng.choice(".,!?"))
+                self.gold_tags.append("Punct")
+                continue
+            if rng.random() < 0.15:
+                lang = 1 - lang
+            self.tokens.append((lang1_test, lang2_test)[lang][k])
+            self.gold_tags.append(TAGS[lang])
+        self.text = " ".join(self.tokens)
+
+    def models(self, storage="dict", n=5):
+        """Return the n-gram models of both languages."""
+        return [CNGram(TAGS[0], self.lang1_words, n=n, storage=storage),
+                CNGram(TAGS[1], self.lang2_words, n=n, storage=storage)]
+
+    def transi_matrix(self):
+        """Return the log transition matrix of the gold tags."""
+        tags = [tag for tag in self.gold_tags if tag in TAGS]
+        counts = {prev: {tag: 0 for tag in TAGS} for prev in TAGS}
+        for prev, tag in zip(tags, tags[1:]):
+            counts[prev][tag] += 1
+        total = float(len(tags) - 1)
+        return {prev: {tag: math.log(c / total) for tag, c in row.items()
+                       if c}
+                for prev, row in counts.items()}
+
+
+class StubNERTagger:
+    """Named Entity Recognizer that tags capitalized tokens as PERSON,
+        standing in for Stanford NER."""
+
+    def tag(self, tokens):
+        return [(token, "PERSON" if token[:1].isupper() else "O")
+                for token in tokens]
+
+
+def bench_split_words(corpus):
+    return (lambda: split_words(corpus.text)), len(corpus.tokens), "tokens"
+
+
+def bench_get_cond_cnts(corpus):
+    return ((lambda: get_cond_cnts(corpus.lang1_words, 5)),
+            len(corpus.lang1_words), "words")
+
+
+def bench_get_cond_cnts_python(corpus):
+    run_kernel = bench_get_cond_cnts(corpus)[0]
+
+    # Times the pure-Python counting even where _cngram is built
+    def run():
+        kernel, cngram.count_ngrams = cngram.count_ngrams, None
+        try:
+            run_kernel()
+        finally:
+            cngram.count_ngrams = kernel
+    return run, len(corpus.lang1_words), "words"
+
+
+def bench_word_prob(corpus, storage="dict"):
+    model = corpus.models(storage)[0]
+    words = corpus.tokens
+
+    def run():
+        for word in words:
+            model.word_prob(word)
+    return run, len(words), "words"
+
+
+def bench_word_prob_compact(corpus):
+    return bench_word_prob(corpus, "compact")
+
+
+def bench_word_prob_q8(corpus):
+    return bench_word_prob(corpus, "q8")
+
+
+def bench_word_prob_hashed(corpus):
+    return bench_word_prob(corpus, "h18")
+
+
+def bench_guess(corpus, cache_size=0, fused=False, lexicon=None):
+    cs_model = CodeSModel(corpus.models(), cache_size, fused, lexicon)
+    words = corpus.tokens
+
+    def run():
+        cs_model.cache_clear()
+        for word in words:
+            cs_model.guess(word)
+    return run, len(words), "words"
+
+
+def bench_guess_cached(corpus):
+    return bench_guess(corpus, 100000)
+
+
+def bench_guess_fused(corpus):
+    return bench_guess(corpus, fused=True)
+
+
+def bench_guess_lexicon(corpus, size=10000):
+    counts = collections.Counter(word.lower() for word in corpus.tokens)
+    lexicon = build_lexicon(corpus.models(),
+                            [word for word, _ in counts.most_common(size)])
+    # Compared with guess_cached, as the lexicon is used with the cache
+    return bench_guess(corpus, 100000, lexicon=lexicon)
+
+
+def bench_gen_tags(corpus):
+    cs_model = CodeSModel(corpus.models())
+    transi_matrix = corpus.transi_matrix()
+
+    def run():
+        cs_model.cache_clear()
+        HiddenMarkovModel(corpus.tokens, TAGS, transi_matrix,
+                          cs_model).gen_tags()
+    return run, len(corpus.tokens), "tokens"
+
+
+def bench_tag_list(corpus):
+    # Imported here so that the other stages run without the NER dependencies
+    from evaluator import Evaluator
+    cs_model = CodeSModel(corpus.models())
+    config = {"lang_set": set(TAGS), "ner_chunk_size": 1000,
+              "ner_workers": 2}
+    evaluator = Evaluator(cs_model, corpus.transi_matrix(), TAGS, config,
+                          [StubNERTagger(), StubNERTagger()])
+
+    def run():
+        cs_model.cache_clear()
+        evaluator.tag_list(corpus.tokens)
+    return run, len(corpus.tokens), "tokens"
+
+
+STAGES = {
+    "split_words": bench_split_words,
+    "get_cond_cnts": bench_get_cond_cnts,
+    "get_cond_cnts_python": bench_get_cond_cnts_python,
+    "word_prob": bench_word_prob,
+    "word_prob_compact": bench_word_prob_compact,
+    "word_prob_q8": bench_word_prob_q8,
+    "word_prob_hashed": bench_word_prob_hashed,
+    "guess": bench_guess,
+    "guess_cached": bench_guess_cached,
+    "guess_fused": bench_guess_fused,
+    "guess_lexicon": bench_guess_lexicon,
+    "gen_tags": bench_gen_tags,
+    "tag_list": bench_tag_list,
+}
+
+
+def measure(stage, corpus, repeat=3):
+    """Runs one stage on a corpus.
+
+    The timing runs take the best of repeat runs; a separate run under
+        tracemalloc records the peak memory allocated by the stage.
+
+    Return:
+        dict: stage, size, unit, seconds, throughput (units/second), peak_mb
+            allocated by the stage and max_rss_mb of the process so far
+    """
+    run, count, unit = STAGES[stage](corpus)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    max_rss = None
+    if resource is not None:
+        # Kilobytes on Linux, bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        max_rss /= 2.0 ** (20 if sys.platform == "darwin" else 10)
+
+    return {"stage": stage, "size": corpus.size, "unit": unit,
+            "seconds": best, "throughput": count / best,
+            "peak_mb": peak / 2.0 ** 20, "max_rss_mb": max_rss}
+
+
+"""Entry points whose import time is measured."""
+IMPORT_MODULES = ["evaluator", "eval_gui", "server", "training"]
+
+
+def import_time(module):
+    """Measures the import of a module in a fresh interpreter with
+        python -X importtime, which needs Python 3.7 or later.
+
+    Return:
+        dict: module, import_ms as reported by importtime (cumulative over
+            the modules it imports) and startup_ms, the wall time of the
+            whole interpreter run
+
+    Raises:
+        ImportError: if the module cannot be imported, or the interpreter
+            does not report import times
+    """
+    # Run next to the modules, which are not installed, from any directory
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+    stderr = process.communicate()[1]
+    startup = time.perf_counter() - start
+    if process.returncode != 0:
+        raise ImportError(stderr.strip().splitlines()[-1])
+
+    # Lines read "import time: <self us> | <cumulative us> | <module>", with
+    # the module indented by its depth; the top level line is the module
+    cumulative = None
+    for line in stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].rstrip() == " " + module:
+            cumulative = int(fields[1])
+    if cumulative is None:
+        raise ImportError("no import time reported; python -X importtime "
+                          "needs Python 3.7")
+    return {"module": module, "import_ms": cumulative / 1000.0,
+            "startup_ms": startup * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Benchmark the stages of the tagger on synthetic "
+                        "bilingual corpora")
+    parser.add_argument(
+            "--sizes",
+            type=str,
+            default="10000,100000",
+            help="comma-separated corpus sizes in tokens "
+                 "(Default: 10000,100000)")
+    parser.add_argument(
+            "--stages",
+            type=str,
+            default=",".join(STAGES),
+            help="comma-separated stages to run (Default: all)")
+    parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="timing runs per stage (Default: 3)")
+    parser.add_argument(
+            "--json",
+            type=str,
+            default=None,
+            help="also write the results to a JSON file (Default: none)")
+    parser.add_argument(
+            "--import-modules",
+            type=str,
+            default=",".join(IMPORT_MODULES),
+            help="comma-separated modules whose import time is measured "
+                 "(Default: {})".format(",".join(IMPORT_MODULES)))
+    args = parser.parse_args()
+
+    imports = []
+    if args.import_modules:
+        print("{:<20}{:>14}{:>14}".format("module", "import ms",
+                                          "startup ms"))
+        for module in args.import_modules.split(","):
+            try:
+                result = import_time(module)
+            except ImportError as e:
+                print("{:<20}  skipped: {}".format(module, e))
+                continue
+            imports.append(result)
+            print("{:<20}{:>14.1f}{:>14.1f}".format(
+                module, result["import_ms"], result["startup_ms"]))
+        print()
+
+    results = []
+    print("{:<20}{:>10}{:>14}{:>10}{:>10}{:>10}".format(
+        "stage", "size", "throughput", "unit/s", "peak MB", "RSS MB"))
+    for size in (int(size) for size in args.sizes.split(",")):
+        corpus = SyntheticCorpus(size)
+        for stage in args.stages.split(","):
+            try:
+                result = measure(stage, corpus, args.repeat)
+            except ImportError as e:
+                print("{:<20}{:>10}  skipped: {}".format(stage, size, e))
+                continue
+            results.append(result)
+            print("{:<20}{:>10}{:>14.0f}{:>10}{:>10.1f}{:>10.1f}".format(
+                stage, size, result["throughput"], result["unit"],
+                result["peak_mb"], result["max_rss_mb"] or 0))
+            sys.stdout.flush()
+
+    if args.json:
+        with open(args.json, mode="w") as out:
+            json.dump({"stages": results, "imports": imports}, out,
+                      indent=2)
+
+
+if __name__ == "__main__":
+    main()
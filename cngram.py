@@ -1,8 +1,45 @@
 #  cngram.py
 #  Using Python 3.4.3
 
+import re
 import math
+import itertools
 from collections import defaultdict, Counter
+from ngram_table import (DictCondProbs, HashedCondProbs, pack_cond_probs,
+                         quantize_cond_probs, updatable, write_table,
+                         append_counts, read_table)
+try:
+    from _cngram import count_ngrams
+except ImportError:  # The compiled kernel is optional, see _cngram.c
+    count_ngrams = None
+
+
+STORAGES = ("dict", "compact", "q16", "q8")
+
+"""Source of CNGram.version numbers."""
+_VERSIONS = itertools.count()
+
+"""Hashed storages: "h<bits>" for a table of 2 ** bits buckets, and
+    "h<bits>c<depth>" for n-gram counts in a count-min sketch of depth rows,
+    e.g. "h20" or "h18c4"."""
+HASHED_STORAGE = re.compile(r"h(\d+)(?:c(\d+))?$")
+
+
+def hashed_storage(storage):
+    """Return the (bits, depth) of a hashed storage, or None if storage is
+        not hashed.
+
+    Raises:
+        ValueError: if the table would have no rows, or more buckets than
+            the model file can count
+    """
+    match = HASHED_STORAGE.match(storage)
+    if match is None:
+        return None
+    bits, depth = int(match.group(1)), int(match.group(2) or 1)
+    if bits < 1 or depth < 1 or depth << bits >= 1 << 32:
+        raise ValueError("Invalid hashed n-gram storage: {}".format(storage))
+    return bits, depth
 
 
 class CNGram:
@@ -14,47 +51,214 @@ class CNGram:
         num_letters (int): Number of letters in the original text. The default
             is 26.
         n (int, optional): The length of the n-gram. The default is 5.
+        storage (str, optional): How the probability tables are held in
+            memory. "dict" keeps nested dictionaries; "compact" packs them
+            into sorted flat arrays, which is several times smaller; "q16"
+            and "q8" also quantize the log probabilities to 16 or 8-bit
+            codes, dropping the raw counts. Hashed storages ("h20",
+            "h18c4", see HASHED_STORAGE) count the n-grams straight into a
+            table of fixed size, which does not grow with the corpus but
+            confuses the n-grams that collide. The default is "dict".
     Properties:
         lang (str): n-gram language
         words (list<str>): Tokenized words for a single language.
         num_letters (int): Number of letters in the original text. The default
             is 26.
         n (int, optional): The length of the n-gram. The default is 5.
+        cond_cnts (DictCondProbs, PackedCondProbs or HashedCondProbs): The
+            log probability tables, which also keep the raw counts they were
+            computed from
+        updates (int): Number of times update added new text
+        version (int): Identifies the tables of the model within this
+            process: a new number is drawn whenever they are built, loaded
+            or updated
     """
 
-    def __init__(self, lang, words, num_letters=26, n=5):
+    def __init__(self, lang, words, num_letters=26, n=5, storage="dict"):
+        hashed = hashed_storage(storage)
+        if hashed is None:
+            self._build(lang, get_cond_cnts(words, n), num_letters, n,
+                        storage)
+            return
+        # Count into the fixed-size table without a dictionary of counts
+        self._build(lang, {}, num_letters, n, storage)
+        self.cond_cnts.add_words(words, n)
+
+    @classmethod
+    def from_counts(cls, lang, cond_cnts, num_letters=26, n=5,
+                    storage="dict"):
+        """Creates a model from conditional counts computed elsewhere, e.g.
+            merged from several processes.
+
+        Args:
+            lang (str): The language of the n-gram model
+            cond_cnts (dict<str, dict<str, int>>): counts as returned by
+                get_cond_cnts, or a HashedCondProbs already counted with
+                the hashed storage
+            num_letters, n, storage: See CNGram
+        Return:
+            CNGram: the model
+        """
+        model = cls.__new__(cls)
+        model._build(lang, cond_cnts, num_letters, n, storage)
+        return model
+
+    def _build(self, lang, cond_cnts, num_letters, n, storage):
+        hashed = hashed_storage(storage)
+        if storage not in STORAGES and hashed is None:
+            raise ValueError("Unknown n-gram storage: {}".format(storage))
         self.lang = lang
-        self.cond_cnts = get_cond_cnts(words, n)
+        self.cond_cnts = cond_cnts
         self.num_letters = num_letters
         self.n = n
+        self.updates = 0
+        self.version = next(_VERSIONS)
+        if hashed is not None:
+            if not isinstance(cond_cnts, HashedCondProbs):
+                self.cond_cnts = HashedCondProbs(*hashed,
+                                                 num_letters=num_letters)
+                self.cond_cnts.add_counts(cond_cnts, num_letters)
+            return
         self._normalize_counts()
+        if storage == "compact":
+            self.cond_cnts = pack_cond_probs(self.cond_cnts, n - 1)
+        elif storage in ("q16", "q8"):
+            self.cond_cnts = quantize_cond_probs(self.cond_cnts, n - 1,
+                                                 int(storage[1:]))
 
     def _normalize_counts(self):
-        """Normalizes the counts within the n-gram's cond_cnts"""
+        """Replaces the counts within the n-gram's cond_cnts with smoothed log
+            probabilities, and precomputes the log probability of an unseen
+            last character for every context. The counts are kept alongside,
+            so that update can renormalize a context without recounting.
+        """
+        cond_probs = DictCondProbs()
         for ctx, cnts in self.cond_cnts.items():
-            for lastc, cnt in cnts.items():
-                ctx_size = len(self.cond_cnts[ctx])
-                self.cond_cnts[ctx][lastc] = (cnt + 1)/float(ctx_size + self.num_letters)
+            cond_probs.set_row(ctx, cnts, self.num_letters)
+        self.cond_cnts = cond_probs
+
+    @property
+    def unseen(self):
+        """float: log P(c | ctx) for a context never seen in training"""
+        return -math.log(self.num_letters)
 
     def ngram_prob(self, ctx, c):
         """Using conditional frequency distribution, calculate p(c | ctx).
         Return:
             float: P(c | ctx)
         """
-        # Return the counts divided by the number of letters
-        ctx_size = len(self.cond_cnts[ctx])
-        return self.cond_cnts.get(ctx, {}).get(c, 1.0/float(ctx_size + self.num_letters))
+        return math.exp(self.cond_cnts.logprob(ctx, c, self.unseen))
 
     def word_prob(self, word):
-        """ Multiply n-gram probabilites for each n-gram in word
+        """ Sum the n-gram log probabilities of each n-gram in the padded
+            word.
+        Return:
+            float: Log probability of a certain word
+        """
+        n = self.n
+        pad = " " * (n - 1)
+        word = pad + word + pad
+        lookup = self.cond_cnts.logprob
+        unseen = self.unseen
+        logprob = 0.0
+        for i in range(len(word) - n + 1):
+            logprob += lookup(word[i:i + n - 1], word[i + n - 1], unseen)
+        return logprob
+
+    def update(self, words, path=None):
+        """Adds new training text to the model without recounting the text
+            it was trained on. Only the contexts occurring in the new words
+            are renormalized; models that were loaded or use compact storage
+            hold the updated contexts next to their packed tables.
+
+        Args:
+            words (list<str>): Tokenized words of the new text
+            path (str, optional): Model file to append the new counts to, so
+                that CNGram.load returns the updated model. Saving the model
+                again rewrites the file with the counts merged.
+        Return:
+            dict<str, dict<str, int>>: The counts of the new words
+        """
+        cond_cnts = get_cond_cnts(words, self.n)
+        self.update_counts(cond_cnts)
+        if path is not None:
+            append_counts(path, cond_cnts)
+        return cond_cnts
+
+    def update_words(self, words):
+        """Adds new training text to a hashed model, counting it straight
+            into the table without a dictionary of its counts. See update.
+
+        Args:
+            words (iterable<str>): Tokenized words of the new text
+        """
+        if not isinstance(self.cond_cnts, HashedCondProbs):
+            raise ValueError("Only hashed n-gram tables count words directly")
+        self.cond_cnts = self.cond_cnts.writable()
+        self.cond_cnts.add_words(words, self.n)
+        self.updates += 1
+        self.version = next(_VERSIONS)
+
+    def update_counts(self, cond_cnts):
+        """Adds n-gram counts computed elsewhere, see update.
+
+        Args:
+            cond_cnts (dict<str, dict<str, int>>): counts as returned by
+                get_cond_cnts
+        """
+        self.cond_cnts = updatable(self.cond_cnts)
+        self.cond_cnts.add_counts(cond_cnts, self.num_letters)
+        self.updates += 1
+        self.version = next(_VERSIONS)
+
+    def pruned(self, min_count=1, top_k=0, entropy=0.0, storage="dict"):
+        """Return a smaller copy of the model, renormalized from the raw
+            counts that remain after pruning. See prune_cond_cnts.
+
+        Args:
+            min_count, top_k, entropy: See prune_cond_cnts
+            storage (str, optional): See CNGram. The default is "dict".
         Return:
-            float: Probability of a certain word
+            CNGram: the pruned model
+        """
+        if isinstance(self.cond_cnts, HashedCondProbs):
+            raise ValueError("Hashed n-gram tables cannot be pruned")
+        cond_cnts = {ctx: self.cond_cnts.row_counts(ctx)
+                     for ctx in self.cond_cnts}
+        cond_cnts = prune_cond_cnts(cond_cnts, self.num_letters, min_count,
+                                    top_k, entropy)
+        return CNGram.from_counts(self.lang, cond_cnts, self.num_letters,
+                                  self.n, storage)
+
+    def save(self, path):
+        """Writes the log probability tables and their counts to a binary
+            model file that can be memory-mapped by CNGram.load.
+
+        Args:
+            path (str): destination file
         """
-        prob = 1.0
-        for ctx, cnts in get_cond_cnts([word], self.n).items():
-            for lastchar, cnt in cnts.items():
-                prob *= self.ngram_prob(ctx, lastchar) * cnt
-        return math.log(prob)
+        write_table(path, self.lang, self.n, self.num_letters, self.cond_cnts)
+
+    @classmethod
+    def load(cls, path):
+        """Opens a model written by CNGram.save without retraining.
+        The log probability tables stay in the memory-mapped file and are only
+            read when looked up. Counts appended by CNGram.update are applied
+            on top of them.
+
+        Args:
+            path (str): model file
+        Return:
+            CNGram: the stored model
+        """
+        model = cls.__new__(cls)
+        model.lang, model.n, model.num_letters, model.cond_cnts, updates = \
+            read_table(path)
+        model.updates = 0
+        model.version = next(_VERSIONS)
+        for cond_cnts in updates:
+            model.update_counts(cond_cnts)
+        return model
 
 
 def get_ngrams(word, n):
@@ -89,6 +293,9 @@ def get_cond_cnts(words, n):
                  "chai" -> ["r" -> 1, "n" -> 1]
                   as an key-value pair.
 
+    The compiled kernel in _cngram is used when it has been built; it gives
+        the same counts in the same order without slicing every n-gram.
+
     Args:
         words (list<str>): words from the training data
         n (int): length of an n-gram
@@ -98,9 +305,67 @@ def get_cond_cnts(words, n):
         frequencies
     """
     cond_cnts = defaultdict(Counter)
+    if count_ngrams is not None:
+        count_ngrams(cond_cnts, words, n)
+        return cond_cnts
     for words in words:
         ngrams = get_ngrams(words, n)
         for ngram in ngrams:
             ctx, lastc = ngram[:n - 1], ngram[-1]
             cond_cnts[ctx][lastc] += 1
     return cond_cnts
+
+
+def merge_cond_cnts(cond_cnts, partial):
+    """Adds the counts of partial into cond_cnts.
+
+    Args:
+        cond_cnts (defaultdict<str, Counter>): counts to update in place
+        partial (dict<str, dict<str, int>>): counts to add
+    Return:
+        defaultdict<str, Counter>: cond_cnts
+    """
+    for ctx, cnts in partial.items():
+        cond_cnts[ctx].update(cnts)
+    return cond_cnts
+
+
+def prune_cond_cnts(cond_cnts, num_letters, min_count=1, top_k=0,
+                    entropy=0.0):
+    """Drops the contexts and continuations that contribute least to a
+        model. A dropped context scores like one never seen in training.
+
+    Args:
+        cond_cnts (dict<str, dict<str, int>>): counts as returned by
+            get_cond_cnts
+        num_letters (int): smoothing constant of the model
+        min_count (int, optional): contexts seen fewer times are dropped.
+            The default is 1.
+        top_k (int, optional): only the top_k most frequent last characters
+            of each context are kept; 0 keeps all. The default is 0.
+        entropy (float, optional): contexts whose log probabilities differ
+            from those of an unseen context by less than this relative
+            entropy, weighted by the frequency of the context, are dropped.
+            The default is 0.0.
+    Return:
+        dict<str, Counter>: the remaining counts
+    """
+    total = sum(sum(cnts.values()) for cnts in cond_cnts.values())
+    unseen = -math.log(num_letters)
+    pruned = {}
+    for ctx, cnts in cond_cnts.items():
+        ctx_total = sum(cnts.values())
+        if ctx_total < min_count:
+            continue
+        cnts = Counter(cnts)
+        if top_k and len(cnts) > top_k:
+            cnts = Counter(dict(cnts.most_common(top_k)))
+            ctx_total = sum(cnts.values())
+        if entropy:
+            denom = math.log(len(cnts) + num_letters)
+            divergence = sum(cnt * (math.log(cnt + 1) - denom - unseen)
+                             for cnt in cnts.values()) / ctx_total
+            if ctx_total / total * divergence < entropy:
+                continue
+        pruned[ctx] = cnts
+    return pruned
@@ -2,21 +2,137 @@
 #  Using Python 3.4.3
 
 import cngram
-from operator import itemgetter
+import threading
+from collections import OrderedDict, namedtuple
+from ngram_table import DictCondProbs
+
+
+"""Statistics of the emission cache of a CodeSModel."""
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "evictions",
+                                     "maxsize", "currsize", "lexicon_hits"])
 
 
 class CodeSModel:
     """The code switched language model.
     This model effectively consists of a series of CNGrams.
+
+    Scores are cached per lowercased word in a bounded LRU cache, so that
+        frequent words are only scored once against every language.
+
+    On request, models with dict storage and the same n are fused into one
+        index mapping each context to the log probabilities of all
+        languages, so that a word is scored against every language in one
+        pass over its n-grams. The index is built from the models as they
+        are when the CodeSModel is created. It is kept alongside their
+        tables, taking about half as much memory again.
+
+    Words missing from the cache are looked up in a precomputed lexicon
+        before they are scored, and cached either way.
+
     Args:
         models (CNGram):
+        cache_size (int, optional): Maximum number of words kept in the
+            emission cache; 0 disables it. The default is 100000.
+        fused (bool, optional): Build the fused index where the models allow
+            it. The default is False.
+        lexicon (Lexicon, optional): Scores of frequent words, built from
+            the same models. The default is None.
 
     Properties:
         models (CNGram):
+        langs (tuple<str>): The order of the languages in score vectors
+        fused (bool): Whether words are scored with the fused index
     """
 
-    def __init__(self, models):
+    def __init__(self, models, cache_size=100000, fused=False, lexicon=None):
         self.models = {model.lang: model for model in models}
+        self.langs = tuple(self.models)
+        self._index = {lang: k for k, lang in enumerate(self.langs)}
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._hits = self._misses = self._evictions = 0
+        self._lexicon_hits = 0
+        self._lock = threading.Lock()
+
+        self.lexicon = lexicon
+        if lexicon is not None and lexicon.langs != self.langs:
+            missing = set(self.langs) - set(lexicon.langs)
+            if missing:
+                raise ValueError("Lexicon has no scores for {}".format(
+                    ", ".join(sorted(missing))))
+            self._lexicon_cols = [lexicon.langs.index(lang)
+                                  for lang in self.langs]
+        else:
+            self._lexicon_cols = None
+
+        ordered = [self.models[lang] for lang in self.langs]
+        self.fused = fused and len({model.n for model in ordered}) == 1 and \
+            all(isinstance(model.cond_cnts, DictCondProbs)
+                for model in ordered)
+        if self.fused:
+            self._n = ordered[0].n
+            self._unseen = tuple(model.unseen for model in ordered)
+            self._fused = fuse_cond_probs(
+                [model.cond_cnts for model in ordered], self._unseen)
+
+    def probs(self, word):
+        """Fetches the log probabilities of a word in every language.
+
+        Args:
+            word (str): The word to score
+
+        Return:
+            tuple<float>: One log probability per language, in the order of
+                langs
+        """
+        lower_word = word.lower()
+        cache = self._cache
+        with self._lock:
+            scores = cache.get(lower_word)
+            if scores is not None:
+                self._hits += 1
+                cache.move_to_end(lower_word)
+                return scores
+
+        if self.lexicon is not None:
+            scores = self.lexicon.get(lower_word)
+        if scores is not None:
+            # Cached too, as the lexicon is slower to search than the cache
+            with self._lock:
+                self._lexicon_hits += 1
+            if self._lexicon_cols is not None:
+                scores = tuple(scores[c] for c in self._lexicon_cols)
+        else:
+            with self._lock:
+                self._misses += 1
+            if self.fused:
+                scores = self._fused_probs(lower_word)
+            else:
+                scores = tuple(self.models[lang].word_prob(lower_word)
+                               for lang in self.langs)
+        if self.cache_size > 0:
+            with self._lock:
+                cache[lower_word] = scores
+                if len(cache) > self.cache_size:
+                    cache.popitem(last=False)
+                    self._evictions += 1
+        return scores
+
+    def _fused_probs(self, word):
+        n = self._n
+        pad = " " * (n - 1)
+        word = pad + word + pad
+        index = self._fused
+        unseen = self._unseen
+        terms = []
+        for i in range(len(word) - n + 1):
+            entry = index.get(word[i:i + n - 1])
+            if entry is None:
+                terms.append(unseen)
+            else:
+                terms.append(entry[0].get(word[i + n - 1], entry[1]))
+        # Summed in n-gram order, like CNGram.word_prob
+        return tuple(sum(column) for column in zip(*terms))
 
     def guess(self, word):
         """Fetches the language a word is most likely to be in,
@@ -27,10 +143,8 @@ class CodeSModel:
         Return
             str: language the word is most likely to be in
         """
-        lower_word = word.lower()
-        model_probs = ((lang, model.word_prob(lower_word)) for lang, model in
-                       self.models.items())
-        return max(model_probs, key=itemgetter(1))[0]
+        scores = self.probs(word)
+        return self.langs[max(range(len(scores)), key=scores.__getitem__)]
 
     def prob(self, lang, word):
         """Fetches the probability of a word to be in a language.
@@ -42,4 +156,51 @@ class CodeSModel:
         Return:
             float: The probability of the word to be in a language
         """
-        return self.models[lang].word_prob(word.lower())
+        return self.probs(word)[self._index[lang]]
+
+    def cache_info(self):
+        """Reports the effectiveness of the emission cache.
+
+        Return:
+            CacheInfo: hits, misses, evictions, maximum and current size, and
+                the misses found in the lexicon, which are not counted as
+                misses
+        """
+        return CacheInfo(self._hits, self._misses, self._evictions,
+                         self.cache_size, len(self._cache),
+                         self._lexicon_hits)
+
+    def cache_clear(self):
+        """Empties the emission cache and resets its statistics."""
+        with self._lock:
+            self._cache.clear()
+            self._hits = self._misses = self._evictions = 0
+            self._lexicon_hits = 0
+
+
+def fuse_cond_probs(tables, unseen):
+    """Merges the conditional probability tables of several languages into
+        one index.
+
+    Args:
+        tables (list<DictCondProbs>): The table of every language
+        unseen (tuple<float>): log P of any character after a context a
+            language never saw, for every language
+
+    Return:
+        dict<str, tuple<dict<str, tuple<float>>, tuple<float>>>: For every
+            context seen in any language, the log probabilities of each last
+            character seen in any language after it, and of any other last
+            character, as one tuple with an entry per language
+    """
+    fused = {}
+    for ctx in set().union(*tables):
+        rows = [table.get(ctx) for table in tables]
+        backoffs = tuple(unseen[k] if row is None else tables[k].backoffs[ctx]
+                         for k, row in enumerate(rows))
+        chars = set().union(*(row for row in rows if row is not None))
+        fused[ctx] = ({c: tuple(backoffs[k] if row is None else
+                                row.get(c, backoffs[k])
+                                for k, row in enumerate(rows))
+                       for c in chars}, backoffs)
+    return fused
@@ -3,18 +3,30 @@
 #  Using Python 3.4.3
 
 import os
-import re
 import csv
 import sys
 import math
 import copy
+import time
+import shutil
+import hashlib
 import argparse
-from cngram import CNGram
+import itertools
+import tempfile
+import threading
+import multiprocessing
+from cngram import CNGram, hashed_storage
+from tokenizer import (Token, WORD, PUNCT, classify, iter_tokens,
+                       iter_words, split_words)
 from cs_model import CodeSModel
+from lexicon import build_lexicon, count_vocabulary, read_lexicon, \
+    write_lexicon
 from hmm import HiddenMarkovModel
 from configparser import ConfigParser
 from collections import Counter
-from nltk.tag.stanford import StanfordNERTagger
+from concurrent.futures import ThreadPoolExecutor
+from ner import get_ner_tagger
+from profiling import Profiler, cprofiled
 
 
 CONFIGS = {}
@@ -22,22 +34,54 @@ VERBOSE = False
 HEADER = False
 TOKENIZE = False
 
+SENTENCE_END = {".", "!", "?"}
 
-def split_words(text, keep_case=True):
-    """Splits a string of white-space separated words into tokens of words
+
+def iter_windows(words, size):
+    """Groups a stream of tokens into windows of at most size tokens, ending
+        each window after its last sentence-final punctuation mark where
+        there is one.
 
     Args:
-        text (str): String containing all words
-        keep_case (bool, optional): Determine if the case of the letters
-            is maintained. Defaults to True.
+        words (iterable<str or Token>): Stream of tokens
+        size (int): Maximum number of tokens in a window
 
-    Returns:
-        list<str>: List of all the tokens within the text
+    Yields:
+        list<str or Token>: Consecutive windows of tokens
     """
-    if not keep_case:
-        text = text.lower()
-    token = re.compile(r'[\w]+|[^\s\w]', re.UNICODE)
-    return re.findall(token, text)
+    window = []
+    boundary = 0
+    for word in words:
+        window.append(word)
+        if (word.text if isinstance(word, Token) else word) in SENTENCE_END:
+            boundary = len(window)
+        if len(window) >= size:
+            cut = boundary or len(window)
+            yield window[:cut]
+            window = window[cut:]
+            boundary = 0
+    if window:
+        yield window
+
+
+def split_sentences(words):
+    """Splits a list of tokens after every sentence-final punctuation mark.
+
+    Args:
+        words (list<str>): The tokens
+
+    Return:
+        list<list<str>>: The sentences, in order
+    """
+    sentences = []
+    start = 0
+    for k, word in enumerate(words):
+        if word in SENTENCE_END:
+            sentences.append(words[start:k + 1])
+            start = k + 1
+    if start < len(words):
+        sentences.append(words[start:])
+    return sentences
 
 
 def get_transi_matrix(gold_tags, langs):
@@ -58,14 +102,15 @@ def get_transi_matrix(gold_tags, langs):
                 |  tag1  |  tag2  |
                 +-----------------+
                 
-    Note that this is for two languages.
+    There is a row and a column for every language.
 
     However, it takes the log of the raw, overall probability of each switch to
         magnify small differences.
 
     Args:
-        gold_tags (list<str>): A list of language tags, should only contain two main
-            languages.
+        gold_tags (iterable<str>): The language tags in order, should only
+            contain the languages of langs. They are read once, so a stream
+            of tags is counted in constant memory.
         langs (list<str>): language.
 
     Returns:
@@ -75,7 +120,12 @@ def get_transi_matrix(gold_tags, langs):
     transi_matrix = {lang: {} for lang in langs}
 
     # Count number of occurrences for each distinct transition between tags
-    bigram_counts = Counter(zip(gold_tags, gold_tags[1:]))
+    bigram_counts = Counter()
+    prev = None
+    for tag in gold_tags:
+        if prev is not None:
+            bigram_counts[prev, tag] += 1
+        prev = tag
     total = sum(bigram_counts.values())
 
     # Compute and normalize the transition matrix
@@ -86,6 +136,371 @@ def get_transi_matrix(gold_tags, langs):
     return transi_matrix
 
 
+def corpus_digest(path):
+    """Return a hex digest of a training corpus, used to key stored models.
+
+    Args:
+        path (str): path to the corpus file
+    """
+    digest = hashlib.sha1()
+    with open(path, mode="rb") as corpus:
+        for block in iter(lambda: corpus.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def model_variant(prune=None, storage="dict"):
+    """Return the suffix of the stored model file of a pruning setting and
+        storage, e.g. "-m2-q8"; "" for a full model.
+    """
+    prune = prune or {}
+    suffix = ""
+    if prune.get("min_count", 1) > 1:
+        suffix += "-m{}".format(prune["min_count"])
+    if prune.get("top_k"):
+        suffix += "-k{}".format(prune["top_k"])
+    if prune.get("entropy"):
+        suffix += "-e{:g}".format(prune["entropy"])
+    if storage in ("q16", "q8") or hashed_storage(storage):
+        suffix += "-" + storage
+    return suffix
+
+
+def model_path(model_dir, lang, n, train_path, prune=None, storage="dict"):
+    """Return the path of the stored model of a language trained on a
+        corpus with the given n, pruning and storage.
+    """
+    return os.path.join(model_dir, "{}-{}-{}{}.cngram".format(
+        lang, n, corpus_digest(train_path), model_variant(prune, storage)))
+
+
+def get_models(corpora, n, model_dir=None, storage="dict", workers=1,
+               profiler=None, prune=None):
+    """Return the n-gram model of each language, trained on its corpus.
+
+    If a model directory is given, a model previously trained on the same
+        corpus with the same n, pruning and quantization is loaded from it
+        instead of retraining, and newly trained models are saved there.
+        With more than one worker, the remaining models are trained in
+        parallel processes.
+
+    Args:
+        corpora (list<tuple<str, str>>): (language tag, training corpus path)
+            pairs
+        n (int): size of character ngrams
+        model_dir (str, optional): directory of stored models
+        storage (str, optional): in-memory storage of newly trained models,
+            see CNGram
+        workers (int, optional): number of training processes
+        profiler (Profiler, optional): times loading, reading, tokenizing
+            and training
+        prune (dict<str, float>, optional): min_count, top_k and entropy
+            arguments of CNGram.pruned
+
+    Returns:
+        list<CNGram>: the language models, in the order of corpora
+    """
+    if profiler is None:
+        profiler = Profiler()
+    models = [None] * len(corpora)
+    model_paths = [None] * len(corpora)
+    for k, (lang, train_path) in enumerate(corpora):
+        if not model_dir:
+            continue
+        model_paths[k] = model_path(model_dir, lang, n, train_path, prune,
+                                    storage)
+        if os.path.isfile(model_paths[k]):
+            if VERBOSE:
+                print("Loading model {}".format(model_paths[k]))
+            try:
+                with profiler.stage("load_model"):
+                    models[k] = CNGram.load(model_paths[k])
+            except ValueError as e:
+                # Written by an older version; retrain and overwrite
+                if VERBOSE:
+                    print(e)
+
+    # Pruning needs the raw counts, which quantized models do not keep
+    final_storage = storage
+    if prune:
+        storage = "dict"
+
+    missing = [k for k, model in enumerate(models) if model is None]
+    if workers > 1 and missing:
+        from training import train_models
+        with profiler.stage("train"):
+            trained = train_models([corpora[k] for k in missing], n=n,
+                                   storage=storage, workers=workers)
+    else:
+        trained = []
+        for k in missing:
+            lang, train_path = corpora[k]
+            if hashed_storage(storage) is not None:
+                # Stream the corpus into the fixed-size table
+                with profiler.stage("train"), \
+                        open(train_path, mode="r", encoding="utf8") as corpus:
+                    trained.append(CNGram(lang, iter_words(corpus), n=n,
+                                          storage=storage))
+                continue
+            with profiler.stage("load_corpus"):
+                text = open(train_path, mode="r", encoding="utf8").read()
+            with profiler.stage("tokenize"):
+                words = split_words(text)
+            with profiler.stage("train"):
+                trained.append(CNGram(lang, words, n=n, storage=storage))
+
+    for k, model in zip(missing, trained):
+        if prune:
+            with profiler.stage("prune"):
+                model = model.pruned(storage=final_storage, **prune)
+        models[k] = model
+        if model_paths[k]:
+            os.makedirs(model_dir, exist_ok=True)
+            model.save(model_paths[k])
+    return models
+
+
+def get_lexicon(models, corpora, model_dir, size, prune=None, storage="dict",
+                profiler=None):
+    """Return the lexicon of the most frequent words of the training corpora,
+        scored against the models.
+
+    The lexicon is stored in the model directory next to the models and
+        loaded from it on later runs with the same model files; it is
+        rebuilt when one of them changes, e.g. after training.py appended
+        counts to it.
+
+    Args:
+        models (list<CNGram>): the language models returned by get_models
+        corpora (list<tuple<str, str>>): (language tag, training corpus path)
+            pairs the models were trained on
+        model_dir (str): directory of stored models
+        size (int): number of words in the lexicon
+        prune (dict<str, float>, optional): pruning of the models, see
+            get_models
+        storage (str, optional): storage of the models, see get_models
+        profiler (Profiler, optional): times loading and building
+
+    Returns:
+        Lexicon: the lexicon, or None without a model directory or size
+    """
+    if not model_dir or size <= 0:
+        return None
+    if profiler is None:
+        profiler = Profiler()
+
+    digest = hashlib.sha1(str(size).encode("utf-8"))
+    for model, (lang, train_path) in zip(models, corpora):
+        path = model_path(model_dir, lang, model.n, train_path, prune, storage)
+        stat = os.stat(path)
+        digest.update("{}\t{}\t{}\n".format(
+            os.path.basename(path), stat.st_size, stat.st_mtime_ns)
+            .encode("utf-8"))
+    path = os.path.join(model_dir, "lexicon-{}.cnlex".format(
+        digest.hexdigest()))
+    if os.path.isfile(path):
+        if VERBOSE:
+            print("Loading lexicon {}".format(path))
+        try:
+            with profiler.stage("load_lexicon"):
+                return read_lexicon(path)
+        except ValueError as e:
+            if VERBOSE:
+                print(e)
+
+    with profiler.stage("build_lexicon"):
+        counts = count_vocabulary(train_path for _, train_path in corpora)
+        # Ties are broken by the word, so the same corpora give the same file
+        frequent = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+        lexicon = build_lexicon(models, [word for word, _ in frequent[:size]])
+    os.makedirs(model_dir, exist_ok=True)
+    write_lexicon(path, lexicon)
+    return lexicon
+
+
+def token_digest(tokens):
+    """Return a hex digest identifying a sequence of tokens.
+
+    Args:
+        tokens (iterable<str>): The tokens
+    """
+    digest = hashlib.sha1()
+    for token in tokens:
+        digest.update((token + "\n").encode("utf-8"))
+    return digest.hexdigest()
+
+
+def iter_gold(gold_standard, gold_delimiter):
+    """Lazily reads the tokens and tags of a gold standard, one row at a
+        time, so that memory use does not grow with its length. Blank lines
+        are skipped.
+
+    Args:
+        gold_standard (str): The path to the gold standard
+        gold_delimiter (str): Column delimiter of the gold standard
+
+    Yields:
+        tuple<str, str>: The token (second-to-last column) and the gold tag
+            (last column) of each row
+    """
+    with open(gold_standard, 'r', encoding='utf-8', newline='') as lines:
+        if len(gold_delimiter) == 1:
+            rows = csv.reader(lines, delimiter=gold_delimiter,
+                              quoting=csv.QUOTE_NONE)
+        else:
+            # The csv module only splits on single characters
+            rows = (line.rstrip("\r\n").split(gold_delimiter)
+                    for line in lines)
+        for row in rows:
+            if row and any(row):
+                yield row[-2].strip(), row[-1].strip()
+
+
+def iter_annotation(annotated):
+    """Lazily reads the tokens, language tags and named entity tags of a
+        file written by Evaluator.annotate.
+
+    Args:
+        annotated (str): The path to the _annotated.tsv file
+
+    Yields:
+        tuple<str, str, str>: The token, language tag and named entity tag
+            of each row
+    """
+    with open(annotated, 'r', encoding='utf-8', newline='') as rows:
+        reader = csv.reader(rows, delimiter='\t', quoting=csv.QUOTE_NONE)
+        next(reader, None)
+        for row in reader:
+            yield row[0], row[1], row[2]
+
+
+def align_annotation(gold, annotation, annotated, gold_standard):
+    """Pairs the rows of a gold standard with those of its annotation.
+
+    Args:
+        gold (iterable<tuple<str, str>>): The rows of iter_gold
+        annotation (iterable<tuple<str, str, str>>): The rows of
+            iter_annotation
+        annotated (str): The path to the annotation, for error messages
+        gold_standard (str): The path to the gold standard, for error
+            messages
+
+    Yields:
+        tuple<str, str, str, str>: The token, gold tag, language tag and
+            named entity tag of each row
+
+    Raises:
+        ValueError: when the annotation has other tokens than the gold
+            standard
+    """
+    missing = (None, None, None)
+    for (token, gold_tag), (tagged, lang, ne) in itertools.zip_longest(
+            gold, annotation, fillvalue=missing):
+        if token != tagged:
+            raise ValueError("{} does not annotate the tokens of {}".format(
+                annotated, gold_standard))
+        yield token, gold_tag, lang, ne
+
+
+def write_evaluation(outfile, rows, local_config):
+    """Compares tagged output to the gold standard's tags and writes the
+        accuracies and a per-token comparison to outfile.
+
+    Rows are compared and written as they arrive, so that memory use does
+        not depend on the number of tokens. They are spooled to a temporary
+        file in the directory of outfile, which is copied below the
+        accuracies once they are known.
+
+    Args:
+        outfile (str): The path of the evaluation file
+        rows (iterable<tuple<str, str, str, str>>): The token, gold standard
+            tag, tagged language and named entity tag of each token
+        local_config (dict<str>): Configuration providing lang_set and ne_tag
+
+    Returns:
+        dict<str, float>: "language_accuracy" and "ne_accuracy"
+    """
+    lang_set = local_config["lang_set"]
+    ne_tag = local_config["ne_tag"]
+    directory = os.path.dirname(os.path.abspath(outfile))
+
+    with tempfile.TemporaryFile(mode='w+', encoding='utf-8',
+                                dir=directory) as spool:
+        # Reset counters to 0, prepare for checking with the gold_standard
+        lang_correct = lang_total = ne_correct = ne_total = 0
+
+        # Compare gold standard and model tags
+        for token, gold, lang, NE in rows:
+            # Evaluate language tags
+            if gold in lang_set:
+                lang_total += 1
+                if gold == lang:
+                    lang_correct += 1
+                    evaluation = "Correct"
+                else:
+                    evaluation = "Incorrect"
+
+            # Evaluate NE tags
+            elif gold == ne_tag:
+                ne_total += 1
+                if NE != 'O':
+                    ne_correct += 1
+                    evaluation = "Correct"
+                else:
+                    evaluation = "Incorrect"
+
+            # Don't evaluate punctuation or number
+            else:
+                evaluation = "NA"
+
+            spool.write("\t".join((token, gold, lang, NE, evaluation)) + "\n")
+
+        # Write the final results to file
+        accuracy = {"language_accuracy": lang_correct / float(lang_total),
+                    "ne_accuracy": ne_correct / float(ne_total)}
+        spool.seek(0)
+        with open(outfile, mode='w', encoding='utf-8') as output:
+            output.write("Language Accuracy: {}\n".format(
+                accuracy["language_accuracy"]))
+            output.write("NE Accuracy: {}\n".format(accuracy["ne_accuracy"]))
+            output.write("Token\tGold Standard\tTagged Language"
+                         "\tNamed Entity\tEvaluation\n")
+            shutil.copyfileobj(spool, output)
+    return accuracy
+
+
+def evaluate_annotation(annotated, gold_standard, local_config=None):
+    """Evaluates an existing annotation file against the gold standard
+        without running any model. The final file will be:
+
+        <gold_standard>_evaluation.tsv
+
+    Args:
+        annotated (str): The path to the _annotated.tsv file
+        gold_standard (str): The path to the gold standard
+        local_config (dict<str>, optional): Optional local changes to the
+            parameters. Defaults to the global configuration.
+
+    Returns:
+        dict<str, float>: See write_evaluation
+    """
+    if local_config is None:
+        local_config = CONFIGS
+    if VERBOSE:
+        print("Evaluating {}...".format(annotated))
+
+    rows = align_annotation(
+        iter_gold(gold_standard, local_config["gold_delimiter"]),
+        iter_annotation(annotated), annotated, gold_standard)
+
+    outfile = os.path.splitext(gold_standard)[0] + "_evaluation.tsv"
+    accuracy = write_evaluation(outfile, rows, local_config)
+
+    if VERBOSE:
+        print("Evaluation file written")
+    return accuracy
+
+
 class Evaluator:
     """Evaluates the input files to determine the language of each word.
 
@@ -101,6 +516,13 @@ class Evaluator:
         tags (list<str>): List of tags.
         local_config (dict<str>, optional): Optional local changes to the parameters.
             Defaults to the global configuration.
+        ner_taggers (list<object>, optional): Named Entity Recognizers, each
+            with a tag(tokens) method. Defaults to the classifiers
+            lang1_class, lang2_class, ... of the configuration, for the
+            languages that have one. They are only started when the first
+            words are tagged.
+        profiler (Profiler, optional): Collects the time spent in each stage.
+            Defaults to a new Profiler.
 
     Properties:
         cs_model (CodeSModel): A code switched language model. Check the file
@@ -110,23 +532,189 @@ class Evaluator:
             the specific format.
         local_config (dict<str>): Dictionary of configuration options
         tags (list<str>): List of tags matched to the langauge
-        lang1_tagger (StanfordNERTagger): The Stanford NER Tagger for language 1
-        lang2_tagger (StanfordNERTagger): The Stanford NER Tagger for language 2
+        annotations (dict<tuple<str, str>, str>): Annotation files written by
+            annotate, keyed by the token digest of the corpus and the
+            fingerprint of the models that tagged it
+        profiler (Profiler): Times the tagging stages: "hmm" for decoding,
+            "ner_start" for starting the NER taggers, "ner" for each NER
+            chunk (summed over all threads), "ner_wait" for time spent
+            waiting on NER results, "merge" for combining the tags,
+            "tokenize" for reading and tokenizing corpora and "write" for
+            writing output. Also counts the tokens tagged.
     """
 
-    def __init__(self, cs_model, transi_matrix, tags, local_config=None):
+    def __init__(self, cs_model, transi_matrix, tags, local_config=None,
+                 ner_taggers=None, profiler=None):
         if local_config is None:
             local_config = copy.deepcopy(CONFIGS)
         self.cs_model = cs_model
         self.transi_matrix = transi_matrix
         self.tags = tags
         self.local_config = local_config
-        self.lang1_tagger = StanfordNERTagger(local_config["lang1_class"],
-                                              local_config["class_jar"])
-        self.lang2_tagger = StanfordNERTagger(local_config["lang2_class"],
-                                              local_config["class_jar"])
+        self._ner_taggers = ner_taggers
+        self.annotations = {}
+        self.profiler = profiler or Profiler()
+        self._lock = threading.Lock()
+        self._ner_pool = None
+        self._hmm_pool = None
+        self._hmm_pool_key = None
+
+    def classifiers(self):
+        """Return the NER classifiers configured for the languages, in the
+            order of tags."""
+        return [self.local_config.get("lang{}_class".format(k + 1))
+                for k in range(len(self.tags))]
+
+    def ner_taggers(self):
+        """Return the Named Entity Recognizers, starting them on first use.
+        """
+        with self._lock:
+            if self._ner_taggers is None:
+                with self.profiler.stage("ner_start"):
+                    self._ner_taggers = [
+                        get_ner_tagger(classifier, self.local_config)
+                        for classifier in self.classifiers() if classifier]
+            return self._ner_taggers
+
+    def close(self):
+        """Shuts down the NER thread pool, the HMM process pool and the Named
+            Entity Recognizers that run as servers."""
+        if self._ner_pool is not None:
+            self._ner_pool.shutdown()
+            self._ner_pool = None
+        self._close_hmm_pool()
+        for tagger in self._ner_taggers or ():
+            if hasattr(tagger, "close"):
+                tagger.close()
+
+    def fingerprint(self):
+        """Return a hex digest of everything that determines the tags
+            produced for a given text: the n-gram models and their storage,
+            the lexicon, transition matrix, NER classifiers and the chunking
+            of the input.
+        """
+        digest = hashlib.sha1()
+        for lang in sorted(self.cs_model.models):
+            model = self.cs_model.models[lang]
+            digest.update(repr((lang, model.version)).encode("utf-8"))
+        lexicon = self.cs_model.lexicon
+        digest.update(repr(None if lexicon is None else lexicon.digest())
+                      .encode("utf-8"))
+        digest.update(repr((self.tags, sorted(
+            (ctx, sorted(row.items()))
+            for ctx, row in self.transi_matrix.items()))).encode("utf-8"))
+        digest.update(repr(self.classifiers() + [
+            self.local_config.get(option) for option in
+            ("ner_backend", "ner_chunk_size", "window_size",
+             "hmm_segment")]).encode("utf-8"))
+        return digest.hexdigest()
+
+    @property
+    def timings(self):
+        """Counter<str, float>: Seconds spent in each stage"""
+        return self.profiler.seconds
+
+    def _add_time(self, stage, start):
+        self.profiler.add(stage, time.perf_counter() - start)
+
+    def _timed_ner(self, tagger, words):
+        start = time.perf_counter()
+        try:
+            return tagger.tag(words)
+        finally:
+            self._add_time("ner", start)
+
+    def submit_ner(self, words):
+        """Dispatches the NER taggers of all languages on every chunk of
+            words to a thread pool of ner_workers threads, so that chunks are
+            tagged concurrently with each other and with HMM decoding.
+
+        Args:
+            words (list<str>): The tokens being processed.
+
+        Return:
+            list<tuple<Future>>: For each chunk of ner_chunk_size words, the
+                pending tags of every NER tagger
+        """
+        taggers = self.ner_taggers()
+        with self._lock:
+            if self._ner_pool is None:
+                self._ner_pool = ThreadPoolExecutor(
+                    self.local_config.get("ner_workers", 2))
+        chunk_size = self.local_config["ner_chunk_size"]
+        return [tuple(self._ner_pool.submit(self._timed_ner, tagger,
+                                            words[k:k + chunk_size])
+                      for tagger in taggers)
+                for k in range(0, len(words), chunk_size)]
+
+    def decode(self, word_lists):
+        """Finds the most likely language of every word with the HMM.
+
+        Each list is decoded as one chain, or, if hmm_segment is "sentence",
+            each of its sentences is. With hmm_workers above 1, the chains
+            are decoded in parallel by forked worker processes, which share
+            the models already loaded in this process.
+
+        Args:
+            word_lists (list<list<str>>): The lists of tokens
 
-    def tag_list(self, word_list):
+        Return:
+            list<str>: The tags of the words of all lists, in order
+        """
+        if self.local_config.get("hmm_segment", "none") == "sentence":
+            chains = [sentence for word_list in word_lists
+                      for sentence in split_sentences(word_list)]
+        else:
+            chains = word_lists
+
+        workers = self.local_config.get("hmm_workers", 1)
+        if workers > 1 and len(chains) > 1 and \
+                "fork" in multiprocessing.get_all_start_methods():
+            pool = self._get_hmm_pool(workers)
+            tags = pool.map(_decode_in_worker, chains,
+                            chunksize=max(1, len(chains) // (4 * workers)))
+        else:
+            tags = map(self._decode, chains)
+        return [tag for chain in tags for tag in chain]
+
+    def _decode(self, words):
+        return HiddenMarkovModel(words, self.tags, self.transi_matrix,
+                                 self.cs_model).gen_tags()
+
+    def _get_hmm_pool(self, workers):
+        global _HMM_EVALUATOR
+        # The workers decode with the models they were forked with; fork new
+        # ones once the models are swapped. The key holds the models, so
+        # that their ids cannot be reused while it does.
+        key = (self.cs_model, self.transi_matrix, workers)
+        with self._lock:
+            if self._hmm_pool_key is None or any(
+                    a is not b for a, b in zip(self._hmm_pool_key, key)):
+                self._close_hmm_pool()
+            if self._hmm_pool is None:
+                _HMM_EVALUATOR = self
+                try:
+                    self._hmm_pool = multiprocessing.get_context("fork").Pool(
+                        workers, initializer=_init_hmm_worker)
+                finally:
+                    _HMM_EVALUATOR = None
+                self._hmm_pool_key = key
+            return self._hmm_pool
+
+    def _close_hmm_pool(self):
+        if self._hmm_pool is not None:
+            self._hmm_pool.terminate()
+            self._hmm_pool.join()
+            self._hmm_pool = None
+            self._hmm_pool_key = None
+
+    def columns(self):
+        """Return the names of the columns produced by tag_list."""
+        return (["Token", "Language", "Named Entity"] +
+                ["{}-NGram Prob".format(tag) for tag in self.tags] +
+                ["HMM Prob", "Total Prob"])
+
+    def tag_list(self, word_list, prev_lang=None):
         """Tagger generates a list of tags, which contains multiple pieces of
             information from many different models and combines them into one
             list.
@@ -135,88 +723,139 @@ class Evaluator:
             1. The word itself
             2. The language tagged
             3. Named entity
-            4. Probability of lang1_prob
-            5. Probability of lang2_prob
-            6. Probability of hmm_prob
-            7. Probability of total_prob
+            4. Probability of the word in each language of tags, one
+               element per language
+            5. Probability of hmm_prob
+            6. Probability of total_prob
 
         The list's order matches the order of word_list.
 
         Args:
-            word_list (list<str>): The list of tokens being processed.
+            word_list (list<str or Token>): The list of tokens being
+                processed. The kind of a Token is used as is; plain strings
+                are classified as punctuation, numbers or words.
+            prev_lang (str, optional): Language of the token preceding
+                word_list, used for the first HMM probability. Defaults to the
+                first tag.
 
         Return:
-            list<tuple<str, str, str, str, str, str, str, str>>:
+            list<tuple<str>>:
                 Refer to the above for list of entries in the tuple,
                 as well as details regarding the list itself.
         """
-        # Why is this generated here?
-        hmm = HiddenMarkovModel(word_list, self.tags, self.transi_matrix,
-                                self.cs_model)
-        hmmtags = hmm.gen_tags()
-        words = hmm.words
-
-        tagged_tokens = []
-        lang1_tags = []
-        lang2_tags = []
-        prev_lang = self.tags[0]
-        lang1_tag = self.tags[0]
-        lang2_tag = self.tags[1]
-
-        token = re.compile(r'[^\w\s]', re.UNICODE)
-
-        # Tag each word based on ngram model and hmm
-        for k, word in enumerate(words):
-            # Check if punctuation or number, otherwise use tag from hmm
-            if re.match(token, word) and not word[-1].isalpha():
-                lang = 'Punct'
-            elif word.isdigit():
-                lang = 'Num'
-            else:
-                lang = hmmtags[k]
+        return self.tag_batch([word_list], prev_lang)[0]
 
-            # Processing chunks of words at a time
-            chunk_size = self.local_config["ner_chunk_size"]
-            index = k % chunk_size
+    def tag_batch(self, word_lists, prev_lang=None):
+        """Tags several independent lists of tokens at once, as tag_list does
+            for one. Each list is decoded by its own HMM, while the NER
+            taggers see all lists together in shared chunks, so that many
+            short inputs cost few NER calls.
 
-            if index == 0:
-                lang1_tags = self.lang1_tagger.tag(words[k:k+chunk_size])
-                lang2_tags = self.lang2_tagger.tag(words[k:k+chunk_size])
-
-            lang1_tag = lang1_tags[index][1]
-            lang2_tag = lang2_tags[index][1]
+        Args:
+            word_lists (list<list<str or Token>>): The lists of tokens being
+                processed.
+            prev_lang (str, optional): See tag_list; applies to every list.
 
-            if lang == "Punct":
-                lang1_tag = "O"
-                lang2_tag = "O"
+        Return:
+            list<list<tuple<str>>>: The rows of tag_list for each list of
+                tokens
+        """
+        kinds = [token.kind if isinstance(token, Token) else classify(token)
+                 for word_list in word_lists for token in word_list]
+        word_lists = [[token.text if isinstance(token, Token) else token
+                       for token in word_list] for word_list in word_lists]
+        words = [word for word_list in word_lists for word in word_list]
+        self.profiler.count("tokens", len(words))
+
+        # Start NER first so that it runs while the HMM decodes
+        ner_chunks = self.submit_ner(words)
+
+        start = time.perf_counter()
+        hmmtags = self.decode(word_lists)
+        self._add_time("hmm", start)
+        start = time.perf_counter()
+
+        batches = []
+        ner_tags = []
+        chunk_size = self.local_config["ner_chunk_size"]
+        cols = [self.cs_model.langs.index(tag) for tag in self.tags]
+        k = 0
+
+        for word_list in word_lists:
+            tagged_tokens = []
+            last_lang = prev_lang or self.tags[0]
+
+            # Tag each word based on ngram model and hmm
+            for word in word_list:
+                # Punctuation and numbers keep their kind, otherwise use tag
+                # from hmm
+                lang = hmmtags[k] if kinds[k] == WORD else kinds[k]
+
+                # Processing chunks of words at a time
+                index = k % chunk_size
+
+                if index == 0:
+                    wait = time.perf_counter()
+                    ner_tags = [future.result()
+                                for future in ner_chunks[k // chunk_size]]
+                    self._add_time("ner_wait", wait)
+                    start += time.perf_counter() - wait
+
+                if lang == PUNCT:
+                    word_ner = ["O"] * len(ner_tags)
+                else:
+                    word_ner = [tags[index][1] for tags in ner_tags]
 
-            # Mark as NE if either NER tagger identifies it
-            if lang1_tag != 'O' or lang2_tag != 'O':
-                ne = "{}/{}".format(lang1_tag, lang2_tag)
-            else:
-                ne = "O"
-
-            # Record probabilities
-            if lang in self.local_config["lang_set"]:
-                hmm_prob = round(hmm.transi_matrix[prev_lang][lang], 2)
-                lang1_prob = round(self.cs_model.prob(self.tags[0], word), 2)
-                lang2_prob = round(self.cs_model.prob(self.tags[1], word), 2)
-                if lang == self.tags[0]:
-                    total_prob = (hmm_prob + lang1_prob)
+                # Mark as NE if any NER tagger identifies it
+                if any(tag != 'O' for tag in word_ner):
+                    ne = "/".join(word_ner)
                 else:
-                    total_prob = (hmm_prob + lang2_prob)
-                prev_lang = lang
-            else:
-                hmm_prob = "N/A"
-                lang1_prob = "N/A"
-                lang2_prob = "N/A"
-                total_prob = "N/A"
+                    ne = "O"
+
+                # Record probabilities
+                if lang in self.local_config["lang_set"]:
+                    # Chains may start with a language never seen after the
+                    # last one, as HiddenMarkovModel.tr allows
+                    hmm_prob = round(self.transi_matrix[last_lang].get(
+                        lang, float("-inf")), 2)
+                    scores = self.cs_model.probs(word)
+                    lang_probs = [round(scores[c], 2) for c in cols]
+                    total_prob = hmm_prob + lang_probs[self.tags.index(lang)]
+                    last_lang = lang
+                else:
+                    hmm_prob = "N/A"
+                    lang_probs = ["N/A"] * len(self.tags)
+                    total_prob = "N/A"
+
+                tagged_tokens.append(
+                    (word, lang, ne) + tuple(map(str, lang_probs)) +
+                    (str(hmm_prob), str(total_prob)))
+                k += 1
+
+            batches.append(tagged_tokens)
 
-            tagged_tokens.append((word, lang, ne,
-                                 str(lang1_prob), str(lang2_prob),
-                                 str(hmm_prob), str(total_prob)))
+        self._add_time("merge", start)
+        return batches
 
-        return tagged_tokens
+    def tag_stream(self, words):
+        """Tags a stream of tokens window by window, so that memory use does
+            not grow with the length of the stream. Each window is decoded
+            and named-entity tagged on its own; see iter_windows.
+
+        Args:
+            words (iterable<str>): The stream of tokens being processed.
+
+        Yields:
+            list<tuple<str>>: The rows of tag_list for each window, in order
+        """
+        prev_lang = None
+        for window in iter_windows(words, self.local_config["window_size"]):
+            rows = self.tag_list(window, prev_lang)
+            for row in reversed(rows):
+                if row[1] in self.tags:
+                    prev_lang = row[1]
+                    break
+            yield rows
 
     def annotate(self, corpus):
         """Annotates a corpus by adding tags for the words of the corpus.
@@ -230,31 +869,84 @@ class Evaluator:
 
         Args:
             corpus (str): The path to the corpus file
+
+        Return:
+            int: The number of tokens annotated
         """
         if VERBOSE:
             print("Annotating...")
 
-        outfile = corpus.split(".")[0] + "_annotated.tsv"
+        outfile = os.path.splitext(corpus)[0] + "_annotated.tsv"
+
+        digest = hashlib.sha1()
+        num_tokens = 0
+        with open(outfile, mode='w', encoding='utf-8') as output, \
+                open(corpus, encoding='utf-8') as text:
+            output.write("\t".join(self.columns()) + "\n")
+
+            # Rows are written as soon as each window is tagged
+            words = self.profiler.iterate("tokenize", iter_tokens(text))
+            for tagged_rows in self.tag_stream(words):
+                start = time.perf_counter()
+                for row in tagged_rows:
+                    digest.update((row[0] + "\n").encode("utf-8"))
+                    csv_row = '\t'.join(str(s) for s in row)
+                    if VERBOSE:
+                        print(csv_row)
+                    output.write(csv_row + "\n")
+                num_tokens += len(tagged_rows)
+                output.flush()
+                self._add_time("write", start)
+
+        self.annotations[(digest.hexdigest(), self.fingerprint())] = outfile
 
-        with open(outfile, mode='w', encoding='utf-8') as output:
-            text = open(corpus).read()
-
-            test_words = split_words(text)
+        if VERBOSE:
+            print("Annotation file written")
+        return num_tokens
 
-            tagged_rows = self.tag_list(test_words)
+    def tag_many(self, documents, workers=1):
+        """Annotates many corpus files with the same models, writing one
+            _annotated.tsv file per document as annotate does.
 
-            output.write("Token\tLanguage\tNamed Entity"
-                         "\tEng-NGram Prob\tSpn-NGram Prob"
-                         "\tHMM Prob\tTotal Prob\n")
+        With more than one worker, documents are spread over forked worker
+            processes, which share the models already loaded in this process
+            instead of receiving a copy per task. NER servers are shared too,
+            and the stage times and counters of the workers are added to the
+            profiler.
 
-            for row in tagged_rows:
-                csv_row = '\t'.join(str(s) for s in row)
-                if VERBOSE:
-                    print(csv_row)
-                output.write(csv_row + "\n")
+        Args:
+            documents (list<str>): The paths to the corpus files
+            workers (int, optional): Number of worker processes. Defaults
+                to 1.
 
-        if VERBOSE:
-            print("Annotation file written")
+        Return:
+            dict<str, float>: "documents", "tokens" and "seconds" taken
+        """
+        global _BATCH_EVALUATOR
+        start = time.perf_counter()
+
+        if workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+            # Start the NER servers before forking, so that the workers share
+            # them instead of each starting their own
+            self.ner_taggers()
+            _BATCH_EVALUATOR = self
+            try:
+                with multiprocessing.get_context("fork").Pool(
+                        workers, initializer=_init_batch_worker) as pool:
+                    results = pool.map(_annotate_in_worker, documents,
+                                       chunksize=1)
+            finally:
+                _BATCH_EVALUATOR = None
+            # The workers timed their stages on their own profilers
+            counts = []
+            for num_tokens, measurements in results:
+                self.profiler.merge(*measurements)
+                counts.append(num_tokens)
+        else:
+            counts = [self.annotate(document) for document in documents]
+
+        return {"documents": len(documents), "tokens": sum(counts),
+                "seconds": time.perf_counter() - start}
 
     def evaluate(self, gold_standard):
         """Evaluates the system, comparing system output to the gold standard's
@@ -262,71 +954,229 @@ class Evaluator:
 
         <gold_standard>_evaluation.tsv
 
+        The gold standard is streamed and tagged window by window, so that
+            memory use does not grow with its length.
+
+        If the gold standard's tokens were already annotated by these models,
+            the annotation file is reused instead of tagging them again.
+
         Args:
             gold_standard (str): The path to the gold standard
+
+        Return:
+            dict<str, float>: See write_evaluation
         """
         if VERBOSE:
             print("Evaluating Performance...")
 
-        outfile = gold_standard.split(".")[0] + "_evaluation.tsv"
+        outfile = os.path.splitext(gold_standard)[0] + "_evaluation.tsv"
 
-        with open(outfile, mode='w', encoding='utf-8') as output:
-            # create list of text and tags
-            lines = open(gold_standard, 'r', encoding='utf-8').readlines()
-            text, gold_tags = [], []
-
-            # Get tokens and gold tags from gold standard
-            for x in lines:
-                columns = x.split(CONFIGS["gold_delimiter"])
-                text.append(columns[-2].strip())
-                gold_tags.append(columns[-1].strip())
-
-            # Tag the text based on the provided models
-            annotated_output = self.tag_list(text)
-            _, lang_tags, ne_tags, _, _, _, _  = map(list, zip(*annotated_output))
-
-            # Reset counters to 0, prepare for checking with the gold_standard
-            lang_correct = lang_total = ne_correct = ne_total = 0
-            evals = []
-
-            # Compare gold standard and model tags
-            for lang, NE, gold in zip(lang_tags, ne_tags, gold_tags):
-                # Evaluate language tags
-                if gold in CONFIGS["lang_set"]:
-                    lang_total += 1
-                    if gold == lang:
-                        lang_correct += 1
-                        evals.append("Correct")
-                    else:
-                        evals.append("Incorrect")
-
-                # Evaluate NE tags
-                elif gold == CONFIGS["ne_tag"]:
-                    ne_total += 1
-                    if NE != 'O':
-                        ne_correct += 1
-                        evals.append("Correct")
-                    else:
-                        evals.append("Incorrect")
-
-                # Don't evaluate punctuation or number
-                else:
-                    evals.append("NA")
+        # Get tokens and gold tags from gold standard
+        gold_delimiter = self.local_config["gold_delimiter"]
 
-            # Write the final results to file
-            output.write("Language Accuracy: {}\n".format(
-                lang_correct / float(lang_total)))
-            output.write("NE Accuracy: {}\n".format(
-                ne_correct / float(ne_total)))
+        # Only hash the tokens when there is an annotation they could match
+        annotated = None
+        if self.annotations:
+            digest = token_digest(token for token, _ in
+                                  iter_gold(gold_standard, gold_delimiter))
+            annotated = self.annotations.get((digest, self.fingerprint()))
+
+        gold = iter_gold(gold_standard, gold_delimiter)
+        if annotated is not None and os.path.isfile(annotated):
+            if VERBOSE:
+                print("Reusing {}".format(annotated))
+            rows = align_annotation(gold, iter_annotation(annotated),
+                                    annotated, gold_standard)
+        else:
+            # Tag the text based on the provided models; the copy of the
+            # gold rows holds at most the window being tagged
+            gold, tokens = itertools.tee(gold)
+            tagged = (row for rows in self.tag_stream(
+                token for token, _ in tokens) for row in rows)
+            rows = ((token, gold_tag, row[1], row[2])
+                    for (token, gold_tag), row in zip(gold, tagged))
+
+        accuracy = write_evaluation(outfile, rows, self.local_config)
+
+        if VERBOSE:
+            print("Evaluation file written")
+        return accuracy
+
+
+# Evaluator inherited by forked batch workers
+_BATCH_EVALUATOR = None
+
+
+def _init_batch_worker():
+    # Threads and locks do not survive a fork; start with fresh ones
+    _BATCH_EVALUATOR._ner_pool = None
+    _BATCH_EVALUATOR._lock = threading.Lock()
+    _BATCH_EVALUATOR.profiler._lock = threading.Lock()
+    _reset_measurements(_BATCH_EVALUATOR.profiler)
+    # Pool workers cannot have children; documents are parallel already
+    _BATCH_EVALUATOR._hmm_pool = None
+    _BATCH_EVALUATOR._hmm_pool_key = None
+    _BATCH_EVALUATOR.local_config = dict(_BATCH_EVALUATOR.local_config,
+                                         hmm_workers=1)
+
+
+def _reset_measurements(profiler):
+    measurements = profiler.seconds, profiler.calls, profiler.counters
+    profiler.seconds, profiler.calls, profiler.counters = \
+        Counter(), Counter(), Counter()
+    return measurements
+
+
+def _annotate_in_worker(document):
+    # Return what this document added, for the parent to merge
+    num_tokens = _BATCH_EVALUATOR.annotate(document)
+    return num_tokens, _reset_measurements(_BATCH_EVALUATOR.profiler)
+
+
+# Evaluator inherited by forked HMM workers
+_HMM_EVALUATOR = None
 
-            output.write("Token\tGold Standard\tTagged Language"
-                         "\tNamed Entity\tEvaluation\n")
 
-            for all_columns in zip(text, gold_tags, lang_tags, ne_tags, evals):
-                output.write("\t".join(all_columns) + "\n")
+def _init_hmm_worker():
+    # The emission cache may have been locked by another thread
+    _HMM_EVALUATOR.cs_model._lock = threading.Lock()
 
+
+def _decode_in_worker(words):
+    return _HMM_EVALUATOR._decode(words)
+
+
+def batch_documents(batch_dir):
+    """Return the corpus files of a directory, skipping files written by the
+        tagger itself."""
+    return sorted(os.path.join(batch_dir, name)
+                  for name in os.listdir(batch_dir)
+                  if os.path.isfile(os.path.join(batch_dir, name)) and
+                  not name.endswith(("_annotated.tsv", "_evaluation.tsv")))
+
+
+"""Pruning, quantization and hashing settings compared by size_report:
+    arguments of CNGram.pruned."""
+SIZE_REPORT_SETTINGS = [
+    {"storage": "compact"},
+    {"storage": "q16"},
+    {"storage": "q8"},
+    {"min_count": 2, "storage": "compact"},
+    {"min_count": 5, "storage": "compact"},
+    {"top_k": 8, "storage": "compact"},
+    {"entropy": 1e-6, "storage": "compact"},
+    {"entropy": 1e-5, "storage": "compact"},
+    {"min_count": 2, "storage": "q8"},
+    {"entropy": 1e-6, "storage": "q8"},
+    {"storage": "h16"},
+    {"storage": "h18"},
+    {"storage": "h20"},
+    {"storage": "h16c4"},
+    {"storage": "h18c4"},
+]
+
+
+def size_report(evaluator, models, gold_standard, settings=None,
+                report=None):
+    """Evaluates pruned, quantized and hashed versions of the models on the
+        gold standard, to choose a trade-off between model size and accuracy.
+
+    Args:
+        evaluator (Evaluator): Tags the gold standard; its cs_model is
+            replaced for every setting
+        models (list<CNGram>): Full models, which must keep their counts
+        gold_standard (str): The path to the gold standard
+        settings (list<dict>, optional): Arguments of CNGram.pruned.
+            Defaults to SIZE_REPORT_SETTINGS.
+        report (str, optional): Path of a tab-separated report
+
+    Return:
+        list<dict>: For every setting, its "variant" (see model_variant),
+            "storage", "bytes" of the stored models, "contexts" and the
+            accuracies returned by Evaluator.evaluate
+    """
+    if settings is None:
+        settings = SIZE_REPORT_SETTINGS
+    cache_size = evaluator.cs_model.cache_size
+
+    rows = []
+    with tempfile.TemporaryDirectory() as model_dir:
+        for setting in settings:
+            prune = dict(setting)
+            storage = prune.pop("storage", "compact")
+            compressed = [model.pruned(storage=storage, **prune)
+                          for model in models]
+            size = 0
+            for model in compressed:
+                path = os.path.join(model_dir, model.lang + ".cngram")
+                model.save(path)
+                size += os.path.getsize(path)
+
+            evaluator.cs_model = CodeSModel(
+                compressed, cache_size,
+                evaluator.local_config.get("fused_index", False))
+            row = {"variant": model_variant(prune, storage)[1:] or "full",
+                   "storage": storage, "bytes": size,
+                   "contexts": sum(len(model.cond_cnts)
+                                   for model in compressed)}
+            row.update(evaluator.evaluate(gold_standard))
+            rows.append(row)
             if VERBOSE:
-                print("Evaluation file written")
+                print(row)
+
+    if report:
+        with open(report, mode="w", newline="") as out:
+            writer = csv.DictWriter(out, ["variant", "storage", "bytes",
+                                          "contexts", "language_accuracy",
+                                          "ne_accuracy"], delimiter="\t")
+            writer.writeheader()
+            writer.writerows(rows)
+    return rows
+
+
+def segment_report(evaluator, gold_standard, workers=4, report=None):
+    """Compares decoding every window of the gold standard as one chain with
+        decoding its sentences separately, serially and in parallel.
+
+    Args:
+        evaluator (Evaluator): Tags the gold standard; its hmm_segment and
+            hmm_workers options are restored afterwards
+        gold_standard (str): The path to the gold standard
+        workers (int, optional): Processes of the parallel run. The default
+            is 4.
+        report (str, optional): Path of a tab-separated report
+
+    Return:
+        list<dict>: For every run, its "hmm_segment", "hmm_workers", the
+            "seconds" spent decoding and the accuracies returned by
+            Evaluator.evaluate
+    """
+    local_config = evaluator.local_config
+    rows = []
+    try:
+        for segment, num_workers in (("none", 1), ("sentence", 1),
+                                     ("sentence", workers)):
+            evaluator.local_config = dict(local_config, hmm_segment=segment,
+                                          hmm_workers=num_workers)
+            evaluator.cs_model.cache_clear()
+            decoding = evaluator.profiler.seconds["hmm"]
+            row = {"hmm_segment": segment, "hmm_workers": num_workers}
+            row.update(evaluator.evaluate(gold_standard))
+            row["seconds"] = evaluator.profiler.seconds["hmm"] - decoding
+            rows.append(row)
+            if VERBOSE:
+                print(row)
+    finally:
+        evaluator.local_config = local_config
+
+    if report:
+        with open(report, mode="w", newline="") as out:
+            writer = csv.DictWriter(out, ["hmm_segment", "hmm_workers",
+                                          "seconds", "language_accuracy",
+                                          "ne_accuracy"], delimiter="\t")
+            writer.writeheader()
+            writer.writerows(rows)
+    return rows
 
 
 def main(local_config=None):
@@ -344,35 +1194,119 @@ def main(local_config=None):
     """
     if local_config is None:
         local_config = CONFIGS
-    n = local_config["ngram"]
-    tagset = list(local_config["lang_set"])
-
-    # Process training corpora
-    lang1_data = split_words(open(local_config["lang1_train"], mode="r", encoding="utf8").read())
-    lang2_data = split_words(open(local_config["lang2_train"], mode="r", encoding="utf8").read())
-
-    # Create language model of training corproa
-    lang1_model = CNGram(tagset[0], lang1_data, n)
-    lang2_model = CNGram(tagset[1], lang2_data, n)
-    cs_model = CodeSModel([lang1_model, lang2_model])
 
-    # Extract tags from gold standard
-    gold_standard = open(local_config["gold_path"], mode="r")
-    gold_delimiter = local_config["gold_delimiter"]
-    gold_tags = [x.split(gold_delimiter)[-1].strip() for x in gold_standard.readlines()]
+    # Score an existing annotation without building any model
+    if local_config.get("evaluate_from"):
+        evaluate_annotation(local_config["evaluate_from"],
+                            local_config["gold_path"], local_config)
+        return
 
-    # Convert all tags to either lang1 or lang2 and remove others
-    gold_tags = [tagset[0] if x in local_config["lang1_other"] else x for x in gold_tags]
-    gold_tags = [tagset[1] if x in local_config["lang2_other"] else x for x in gold_tags]
-    gold_tags = [x for x in gold_tags if x in tagset]
-
-    # Compute prior based on gold standard
-    transitions = get_transi_matrix(gold_tags, tagset)
+    n = local_config["ngram"]
+    tagset = list(local_config["lang_set"])
+    profiler = Profiler(trace_memory=bool(local_config.get("profile")))
+
+    model_dir = local_config.get("model_dir")
+    storage = local_config.get("ngram_storage", "dict")
+    prune = {"min_count": local_config.get("prune_min_count", 1),
+             "top_k": local_config.get("prune_top_k", 0),
+             "entropy": local_config.get("prune_entropy", 0.0)}
+    if prune == {"min_count": 1, "top_k": 0, "entropy": 0.0}:
+        prune = None
+    if local_config.get("size_report"):
+        # The variants are pruned and quantized from the full models
+        storage, prune = "compact", None
+
+    # Create language model of training corpora, or load stored ones
+    corpora = [(tag, local_config["lang{}_train".format(k + 1)])
+               for k, tag in enumerate(tagset)]
+    lexicon = None
+    if local_config.get("attach"):
+        # Map the models loaded into the shared model store
+        from model_store import attach
+        with profiler.stage("load_model"):
+            models, lexicon = attach(local_config["attach"], tagset,
+                                     local_config.get("model_store") or None)
+    else:
+        models = get_models(corpora, n, model_dir, storage,
+                            local_config.get("train_workers", 1), profiler,
+                            prune)
+        if not local_config.get("size_report"):
+            lexicon = get_lexicon(models, corpora, model_dir,
+                                  local_config.get("lexicon_size", 0), prune,
+                                  storage, profiler)
+    cs_model = CodeSModel(models,
+                          local_config.get("emission_cache_size", 100000),
+                          local_config.get("fused_index", False), lexicon)
+
+    with profiler.stage("transitions"):
+        # Convert all tags to one of the languages and remove others
+        lang_of = {}
+        for k, tag in enumerate(tagset):
+            for other in local_config.get("lang{}_other".format(k + 1), ()):
+                lang_of[other] = tag
+        for tag in tagset:
+            lang_of.setdefault(tag, tag)
+
+        # Compute prior based on gold standard, streaming its tags
+        gold_tags = (lang_of.get(tag) for _, tag in iter_gold(
+            local_config["gold_path"], local_config["gold_delimiter"]))
+        transitions = get_transi_matrix(
+            (tag for tag in gold_tags if tag is not None), tagset)
 
     # Create evaluator for input corpus, annotate, and evaluate
-    evaluator = Evaluator(cs_model, transitions, tagset)
-    evaluator.annotate(local_config["infile"])
-    evaluator.evaluate(local_config["gold_path"])
+    evaluator = Evaluator(cs_model, transitions, tagset, local_config,
+                          profiler=profiler)
+    try:
+        if local_config.get("serve"):
+            from server import serve
+            serve(evaluator, local_config["serve"],
+                  workers=local_config.get("serve_workers", 1),
+                  max_wait=local_config.get("serve_batch_wait", 10) / 1000.0,
+                  verbose=VERBOSE)
+        elif local_config.get("size_report"):
+            rows = size_report(evaluator, models,
+                               local_config["gold_path"],
+                               report=local_config["size_report"])
+            print("{:<24}{:>12}{:>10}{:>10}".format(
+                "variant", "bytes", "contexts", "accuracy"))
+            for row in rows:
+                print("{:<24}{:>12}{:>10}{:>10.4f}".format(
+                    row["variant"], row["bytes"], row["contexts"],
+                    row["language_accuracy"]))
+        elif local_config.get("segment_report"):
+            rows = segment_report(evaluator, local_config["gold_path"],
+                                  max(local_config.get("hmm_workers", 1), 2),
+                                  local_config["segment_report"])
+            print("{:<12}{:>8}{:>10}{:>10}".format(
+                "segment", "workers", "seconds", "accuracy"))
+            for row in rows:
+                print("{:<12}{:>8}{:>10.2f}{:>10.4f}".format(
+                    row["hmm_segment"], row["hmm_workers"], row["seconds"],
+                    row["language_accuracy"]))
+        elif local_config.get("batch_dir"):
+            stats = evaluator.tag_many(
+                batch_documents(local_config["batch_dir"]),
+                local_config.get("batch_workers", 1))
+            print("Tagged {} documents, {} tokens in {:.2f}s: {:.1f} docs/s, "
+                  "{:.0f} tokens/s".format(
+                      stats["documents"], stats["tokens"], stats["seconds"],
+                      stats["documents"] / stats["seconds"],
+                      stats["tokens"] / stats["seconds"]))
+        else:
+            with cprofiled(local_config.get("cprofile")):
+                evaluator.annotate(local_config["infile"])
+                evaluator.evaluate(local_config["gold_path"])
+    finally:
+        evaluator.close()
+
+    if local_config.get("profile"):
+        profiler.write_report(local_config["profile"], cs_model)
+
+    if VERBOSE:
+        print("Emission cache: {}".format(cs_model.cache_info()))
+        print("Stage timings (s): {}".format(
+            ", ".join("{} {:.2f}".format(stage, seconds)
+                      for stage, seconds in sorted(profiler.seconds.items()))))
 
 
 def parse_config():
@@ -393,22 +1327,40 @@ def parse_config():
     gold = config["GOLD"]
     advanced = config["ADVANCED"]
 
-    CONFIGS["lang_set"] = set(default["lang_set"].split(","))
+    # Ordered: the n-th language is trained on langn_train
+    CONFIGS["lang_set"] = default["lang_set"].split(",")
     CONFIGS["ngram"] = default.getint("ngram")
     CONFIGS["tokenize"] = default.getboolean("tokenize")
     CONFIGS["header"] = default.getboolean("header")
     CONFIGS["verbose"] = default.getboolean("verbose")
 
-    if gold["lang1_other"]:
-        CONFIGS["lang1_other"] = set(gold["lang1_other"].split(","))
-
-    if gold["lang2_other"]:
-        CONFIGS["lang2_other"] = set(gold["lang2_other"].split(","))
+    for k in range(len(CONFIGS["lang_set"])):
+        option = "lang{}_other".format(k + 1)
+        other = gold.get(option, "")
+        CONFIGS[option] = set(other.split(",")) if other else set()
 
     if gold["other_tags"]:
         CONFIGS["other_tags"] = set(gold["other_tags"].split(","))
 
     CONFIGS["ner_chunk_size"] = advanced.getint("ner_chunk_size")
+    CONFIGS["train_workers"] = advanced.getint("train_workers", fallback=1)
+    CONFIGS["batch_workers"] = advanced.getint("batch_workers", fallback=1)
+    CONFIGS["serve_workers"] = advanced.getint("serve_workers", fallback=1)
+    CONFIGS["serve_batch_wait"] = advanced.getint("serve_batch_wait",
+                                                  fallback=10)
+    CONFIGS["ner_workers"] = advanced.getint("ner_workers", fallback=2)
+    CONFIGS["window_size"] = advanced.getint("window_size", fallback=5000)
+    CONFIGS["emission_cache_size"] = advanced.getint("emission_cache_size",
+                                                     fallback=100000)
+    CONFIGS["fused_index"] = advanced.getboolean("fused_index",
+                                                 fallback=False)
+    CONFIGS["hmm_workers"] = advanced.getint("hmm_workers", fallback=1)
+    CONFIGS["lexicon_size"] = advanced.getint("lexicon_size", fallback=0)
+    CONFIGS["prune_min_count"] = advanced.getint("prune_min_count",
+                                                 fallback=1)
+    CONFIGS["prune_top_k"] = advanced.getint("prune_top_k", fallback=0)
+    CONFIGS["prune_entropy"] = advanced.getfloat("prune_entropy",
+                                                 fallback=0.0)
 
     # Put remaining options into global dict
     for section in config:
@@ -444,6 +1396,74 @@ def parse_args():
             type=str,
             default="\t",
             help="delimiter for gold standard file (Default: tab)")
+    parser.add_argument(
+            "--model-dir",
+            type=str,
+            default=None,
+            help="directory of stored language models (Default: none)")
+    parser.add_argument(
+            "--evaluate-from",
+            type=str,
+            default=None,
+            metavar="ANNOTATED",
+            help="evaluate an existing _annotated.tsv file against the gold "
+                 "standard without tagging (Default: none)")
+    parser.add_argument(
+            "--batch-dir",
+            type=str,
+            default=None,
+            help="annotate every corpus file in a directory instead of "
+                 "infile (Default: none)")
+    parser.add_argument(
+            "--serve",
+            type=int,
+            default=None,
+            metavar="PORT",
+            help="keep the models loaded and serve tagging requests over "
+                 "HTTP on a local port (Default: off)")
+    parser.add_argument(
+            "--profile",
+            type=str,
+            default=None,
+            metavar="REPORT",
+            help="write a JSON report of time, calls, throughput, cache hit "
+                 "rate and peak memory per stage (Default: none)")
+    parser.add_argument(
+            "--cprofile",
+            type=str,
+            default=None,
+            metavar="STATS",
+            help="dump cProfile statistics of annotation and evaluation "
+                 "(Default: none)")
+    parser.add_argument(
+            "--size-report",
+            type=str,
+            default=None,
+            metavar="REPORT",
+            help="evaluate pruned and quantized versions of the models on "
+                 "the gold standard and write their sizes and accuracies to "
+                 "a tab-separated file (Default: none)")
+    parser.add_argument(
+            "--segment-report",
+            type=str,
+            default=None,
+            metavar="REPORT",
+            help="compare the time and accuracy of decoding whole windows "
+                 "and single sentences on the gold standard and write them "
+                 "to a tab-separated file (Default: none)")
+    parser.add_argument(
+            "--attach",
+            type=str,
+            default=None,
+            metavar="NAME",
+            help="use the models loaded into the shared model store as NAME "
+                 "by model_store.py instead of training or loading them "
+                 "(Default: none)")
+    parser.add_argument(
+            "--no-ner",
+            action="store_true",
+            help="only identify languages, without starting the Named Entity "
+                 "Recognizers (Default: False)")
     parser.add_argument(
             "-v", "--verbose",
             action="store_true",
@@ -467,6 +1487,9 @@ def parse_args():
     if args.tokenize:
         TOKENIZE = True
 
+    if args.no_ner:
+        CONFIGS["ner_backend"] = "none"
+
     # Update global options dict
     CONFIGS.update(vars(args))
 
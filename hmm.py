@@ -2,15 +2,8 @@
 #  Using Python 3.4.3
 
 import math
-from functools import reduce
+from array import array
 from cs_model import CodeSModel
-from collections import namedtuple
-
-
-"""A namedtuple for use with the hidden Markov model, specifically made for
-    use with the viterbi algorithm.
-"""
-HMMNode = namedtuple("HMMNode", ["prob", "p_tag"])
 
 
 class HiddenMarkovModel:
@@ -22,7 +15,7 @@ class HiddenMarkovModel:
         words (list<str>): list of words
         tag_set (list<str>): list of tags
         transi_matrix (dict<str -> dict<str -> float>>): transition matrix.
-            See the method in eval.py. As of now, is a 2x2 matrix.
+            See the method in eval.py, with a row per tag in tag_set.
         cs_model (CodeSModel): The code switched language model of the
             corpus.
 
@@ -30,14 +23,15 @@ class HiddenMarkovModel:
         words (list<str>): list of words
         tag_set (list<str>): list of tags
         transi_matrix (dict<str -> dict<str -> float>>): transition matrix.
-            See the method in eval.py. As of now, is a 2x2 matrix.
+            See the method in eval.py, with a row per tag in tag_set.
         cs_model (CodeSModel): The code switched language model of the
             corpus.
-        v (list<list<HMMNode>>): A series of nodes representiing the provided
-            words.  This will be filled with useful info once the method
-            viterbi is called, and the data processed. There is one set of
-            nodes for each word, and each of these sets carry one node for
-            every language tag.
+        v (list<list<float>>): The Viterbi trellis. This will be filled once
+            the method viterbi is called: for each word, the log probability
+            of the best path ending in every language tag.
+        backptrs (array<int>): For each word after the first and every tag,
+            the index of the best previous tag, stored row-major with one row
+            of len(tag_set) entries per word.
 
     """
 
@@ -46,8 +40,8 @@ class HiddenMarkovModel:
         self.tag_set = tag_set
         self.transi_matrix = transi_matrix
         self.cs_model = cs_model
-        self.v = [[HMMNode(0, 0) for _ in range(len(tag_set))]
-                  for _ in range(len(words))]
+        self.v = []
+        self.backptrs = array("i")
 
     def gen_tags(self):
         """Generate the tags of the language using the viterbi alogrithm to
@@ -76,12 +70,24 @@ class HiddenMarkovModel:
         """
         return self.cs_model.prob(lang, word)
 
+    def emission_matrix(self):
+        """Scores every word against every tag in one batch.
+
+        Return:
+            list<list<float>>: For each word, the emission log probability of
+                every tag in tag_set
+        """
+        cols = [self.cs_model.langs.index(tag) for tag in self.tag_set]
+        probs = self.cs_model.probs
+        return [[scores[c] for c in cols] for scores in map(probs, self.words)]
+
     def tr(self, ctx, tag):
         """Determines the transmission probability of a node.
 
         The transmission probability is the likelihood of a single state
             to transition to another state. That state can be either the
-            same or different from the original state.
+            same or different from the original state. Transitions never seen
+            in the gold standard are impossible.
 
         Args:
             ctx (str): the source state
@@ -91,48 +97,46 @@ class HiddenMarkovModel:
             float: probability of transitioning from the given state to the
                 new state.
         """
-        return self.transi_matrix[ctx][tag]
+        return self.transi_matrix[ctx].get(tag, float("-inf"))
 
     def viterbi(self):
         """Runs the viterbi algorithm on the setup of the hidden Markov model.
 
         The following is a description of the algorithm:
-            in the first node set, for each language, assume a base possibility
-            for each word
-                for each language node
-                    craft the set of possible nodes (previous to current state)
-                determine the most likely previous node for each current node
-                save the node with a reference to the most likely past node
+            for the first word, each tag starts with a uniform prior plus the
+            emission of the word
+            for each following word
+                for each language tag
+                    add the transition from every previous tag to its score
+                    keep the best previous tag as a backpointer
+                    add the emission of the word under the tag
 
         At the end of the Viterbi algorithm, the most likely paths
             from the available bases should be generated.
         """
-        for k, tag in enumerate(self.tag_set):
-            self.v[0][k] = HMMNode(math.log(0.5), -1)
-
-        for word_index, word in enumerate(self.words[1:]):
-            # Skip over first word
-            if word_index == 0:
-                pass
-
-            for tag_index, next_tag in enumerate(self.tag_set):
-                tran_prob = []
-
-                for old_tag_index, prev_tag in enumerate(self.tag_set):
-                    prev_prob = self.v[word_index - 1][old_tag_index].prob + \
-                                self.tr(prev_tag, next_tag)
-                    prev_node = HMMNode(prev_prob, old_tag_index)
-                    tran_prob.append(prev_node)
-
-                nextnode = reduce(  # Looks for the node with highest prob
-                    lambda n1, n2: n1 if n1.prob > n2.prob else n2,
-                    tran_prob)
-
-                em_prob = self.em(self.tag_set[tag_index],
-                                  self.words[word_index])
-                self.v[word_index][tag_index] = HMMNode(em_prob +
-                                                        nextnode.prob,
-                                                        nextnode.p_tag)
+        self.v = []
+        self.backptrs = array("i")
+        if not self.words:
+            return
+
+        tags = range(len(self.tag_set))
+        trans = [[self.tr(prev_tag, next_tag) for prev_tag in self.tag_set]
+                 for next_tag in self.tag_set]
+        emissions = self.emission_matrix()
+
+        start = -math.log(len(self.tag_set))
+        prev = [start + em_prob for em_prob in emissions[0]]
+        self.v.append(prev)
+
+        for em_probs in emissions[1:]:
+            curr = []
+            for next_index in tags:
+                scores = [p + t for p, t in zip(prev, trans[next_index])]
+                best = max(tags, key=scores.__getitem__)
+                self.backptrs.append(best)
+                curr.append(scores[best] + em_probs[next_index])
+            self.v.append(curr)
+            prev = curr
 
     def retrace(self):
         """Reverse traverses the graph generated by the viterbi algorithm to
@@ -141,19 +145,19 @@ class HiddenMarkovModel:
         Returns:
             list<str>: the most likely tag combinations
         """
-        tags = [""] * len(self.words)
+        if not self.v:
+            return []
 
-        # Find most probable final tag
-        last = reduce(lambda x, y: x if self.v[len(self.words) - 1][x].prob >
-                      self.v[len(self.words) - 1][y].prob else y,
-                      range(len(self.tag_set)))
+        num_tags = len(self.tag_set)
+        last = self.v[-1]
 
-        tags[len(self.words) - 1] = self.tag_set[last]
+        # Find most probable final tag
+        best = max(range(num_tags), key=last.__getitem__)
+        path = [best]
 
         # Follow backpointers to most probable previous tags
-        prev = self.v[len(self.words) - 1][last].p_tag
-        for k in range(len(self.words) - 2, -1, -1):
-            tags[k] = self.tag_set[prev]
-            prev = self.v[k][prev].p_tag
+        for k in range(len(self.v) - 1, 0, -1):
+            best = self.backptrs[(k - 1) * num_tags + best]
+            path.append(best)
 
-        return tags
+        return [self.tag_set[k] for k in reversed(path)]
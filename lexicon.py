@@ -0,0 +1,190 @@
+#  lexicon.py
+#  Using Python 3.4.3
+
+import sys
+import mmap
+import hashlib
+import struct
+from array import array
+from collections import Counter
+from tokenizer import iter_words
+from ngram_table import MappedBytes
+
+
+"""Binary lexicon file layout (all sections padded to 8 bytes):
+
+    header      magic, version, byte order, number of languages, number of
+                words, size of the word section and the language names,
+                separated by tabs
+    offsets     (words + 1) uint32, start of each word in the word section
+    words       lowercased words in UTF-8, sorted by their bytes
+    scores      float64 log probability of each word in every language, one
+                row per word in the order of the language names
+"""
+MAGIC = b"CNGL"
+VERSION = 1
+HEADER = struct.Struct("<4sHcxIIII")
+ALIGN = 8
+
+
+def _pad(size):
+    return -size % ALIGN
+
+
+class Lexicon:
+    """Log probabilities of a fixed vocabulary in every language, held in
+        sorted flat buffers and looked up by binary search. The buffers may
+        be plain arrays or views over a memory-mapped lexicon file.
+
+    Args:
+        langs (tuple<str>): The order of the languages in score vectors
+        offsets (sequence<int>): start of each word in words
+        words (bytes or mmap): the words in UTF-8, sorted by their bytes
+        scores (sequence<float>): len(langs) log probabilities per word
+
+    Properties:
+        langs (tuple<str>): The order of the languages in score vectors
+    """
+
+    def __init__(self, langs, offsets, words, scores):
+        self.langs = tuple(langs)
+        self.offsets = offsets
+        self.words = words
+        self.scores = scores
+        self._size = len(offsets) - 1
+        self._digest = None
+
+    def find(self, word):
+        """Return the index of a word, or -1 if it is not in the lexicon."""
+        key = word.encode("utf-8")
+        offsets = self.offsets
+        words = self.words
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if words[offsets[mid]:offsets[mid + 1]] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._size and words[offsets[lo]:offsets[lo + 1]] == key:
+            return lo
+        return -1
+
+    def get(self, word):
+        """Return the log probabilities of a lowercased word in every
+            language, in the order of langs, or None if it is not in the
+            lexicon."""
+        index = self.find(word)
+        if index < 0:
+            return None
+        width = len(self.langs)
+        return tuple(self.scores[index * width:(index + 1) * width])
+
+    def digest(self):
+        """Return a hex digest of the words and scores of the lexicon."""
+        if self._digest is None:
+            digest = hashlib.sha1("\t".join(self.langs).encode("utf-8"))
+            for data in (self.offsets, self.words[0:len(self.words)],
+                         self.scores):
+                digest.update(bytes(data))
+            self._digest = digest.hexdigest()
+        return self._digest
+
+    def __contains__(self, word):
+        return self.find(word) >= 0
+
+    def __len__(self):
+        return self._size
+
+
+def count_vocabulary(paths):
+    """Counts the lowercased words of corpus files.
+
+    Args:
+        paths (list<str>): The corpus files
+
+    Return:
+        Counter<str, int>: The number of occurrences of each word
+    """
+    counts = Counter()
+    for path in paths:
+        with open(path, encoding="utf-8") as corpus:
+            counts.update(word.lower() for word in iter_words(corpus))
+    return counts
+
+
+def build_lexicon(models, words):
+    """Scores words against every language model.
+
+    Args:
+        models (list<CNGram>): The language models
+        words (iterable<str>): The lowercased words to include
+
+    Return:
+        Lexicon: The lexicon, with the languages in the order of models
+    """
+    keys = sorted(word.encode("utf-8") for word in set(words))
+    offsets = array("I", [0])
+    scores = array("d")
+    for key in keys:
+        offsets.append(offsets[-1] + len(key))
+        word = key.decode("utf-8")
+        scores.extend(model.word_prob(word) for model in models)
+    return Lexicon([model.lang for model in models], offsets, b"".join(keys),
+                   scores)
+
+
+def write_lexicon(path, lexicon):
+    """Write a lexicon to a binary file that can be memory-mapped by
+        read_lexicon.
+
+    Args:
+        path (str): destination file
+        lexicon (Lexicon): the lexicon
+    """
+    byteorder = b"<" if sys.byteorder == "little" else b">"
+    names = "\t".join(lexicon.langs).encode("utf-8")
+    words = lexicon.words[0:len(lexicon.words)]
+    header = HEADER.pack(MAGIC, VERSION, byteorder, len(lexicon.langs),
+                         len(lexicon), len(words), len(names)) + names
+
+    with open(path, mode="wb") as out:
+        for data in (header, lexicon.offsets, words, lexicon.scores):
+            data = bytes(data)
+            out.write(data)
+            out.write(b"\0" * _pad(len(data)))
+
+
+def read_lexicon(path):
+    """Memory-map a lexicon file written by write_lexicon.
+
+    Return:
+        Lexicon: the lexicon
+    """
+    with open(path, mode="rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, byteorder, num_langs, num_words, words_size, \
+        names_len = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("{} is not a version {} lexicon file".format(
+            path, VERSION))
+    if byteorder != (b"<" if sys.byteorder == "little" else b">"):
+        raise ValueError("{} was written on a machine with a different "
+                         "byte order".format(path))
+
+    pos = HEADER.size
+    langs = buf[pos:pos + names_len].decode("utf-8").split("\t")
+    pos += names_len + _pad(HEADER.size + names_len)
+
+    view = memoryview(buf)
+    size = 4 * (num_words + 1)
+    offsets = view[pos:pos + size].cast("I")
+    pos += size + _pad(size)
+    words = MappedBytes(buf, pos, words_size)
+    pos += words_size + _pad(words_size)
+    size = 8 * num_words * num_langs
+    scores = view[pos:pos + size].cast("d")
+
+    return Lexicon(langs, offsets, words, scores)
+
@@ -0,0 +1,256 @@
+#  model_store.py
+#  Using Python 3.4.3
+
+import os
+import json
+import shutil
+import argparse
+import tempfile
+from cngram import CNGram
+from lexicon import read_lexicon
+
+
+"""Store of model sets kept resident in shared memory. Every set is a
+    directory of model files on a RAM-backed file system (/dev/shm where
+    there is one), which processes attach to by memory-mapping its files:
+    the tables are read from the same physical pages by every process,
+    instead of each process loading its own copy.
+
+    <store>/<name>/manifest.json    languages, files and their sources
+    <store>/<name>/<lang>.cngram    the models, see CNGram.save
+    <store>/<name>/lexicon.cnlex    optionally, see lexicon.py
+
+    <store>/<name> is a symbolic link to a hidden directory holding one
+    version of the set, so that loading a new version swaps the link in a
+    single rename.
+"""
+MANIFEST = "manifest.json"
+LEXICON = "lexicon.cnlex"
+
+
+def default_store():
+    """Return the store directory used when none is configured."""
+    root = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(root, "cngram-models")
+
+
+def _set_dir(name, store):
+    if not name or name.startswith(".") or os.sep in name:
+        raise ValueError("Invalid model set name: {!r}".format(name))
+    return os.path.join(store or default_store(), name)
+
+
+def load(name, model_paths, lexicon_path=None, store=None):
+    """Copies model files into the store as the set name, replacing any set
+        of that name. The new set replaces the old one at once; processes
+        already attached to the old set keep using it until they exit.
+
+    Args:
+        name (str): name of the set
+        model_paths (list<str>): model files written by CNGram.save, one per
+            language. Files with updates appended are stored rewritten with
+            the updates merged.
+        lexicon_path (str, optional): lexicon file built from these models
+        store (str, optional): store directory. Defaults to default_store().
+
+    Return:
+        dict: the manifest of the set
+    """
+    path = _set_dir(name, store)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix=".{}-".format(name),
+                                dir=os.path.dirname(path))
+    manifest = {"name": name, "models": [], "lexicon": None}
+    try:
+        for model_path in model_paths:
+            stored = CNGram.load(model_path)
+            lang = stored.lang
+            if any(model["lang"] == lang for model in manifest["models"]):
+                raise ValueError("Two models of {} given".format(lang))
+            filename = lang + ".cngram"
+            if stored.updates:
+                # Merge the appended updates into the table once, instead of
+                # every attached process applying them to a private copy
+                stored.save(os.path.join(tmp_path, filename))
+            else:
+                shutil.copyfile(model_path, os.path.join(tmp_path, filename))
+            manifest["models"].append({"lang": lang, "file": filename,
+                                       "source": os.path.abspath(model_path)})
+        if lexicon_path:
+            shutil.copyfile(lexicon_path, os.path.join(tmp_path, LEXICON))
+            manifest["lexicon"] = LEXICON
+        with open(os.path.join(tmp_path, MANIFEST), mode="w") as out:
+            json.dump(manifest, out, indent=2)
+
+        # Swap the link to the new version in; the old version stays mapped
+        # where attached
+        old_path = None
+        if os.path.islink(path):
+            old_path = os.path.realpath(path)
+        elif os.path.isdir(path):
+            # A set loaded before sets were links; move it out of the way
+            old_path = tmp_path + ".old"
+            os.replace(path, old_path)
+        tmp_link = tmp_path + ".link"
+        os.symlink(os.path.basename(tmp_path), tmp_link)
+        try:
+            os.replace(tmp_link, path)
+        except OSError:
+            os.remove(tmp_link)
+            raise
+        tmp_path = None
+        if old_path is not None:
+            shutil.rmtree(old_path, ignore_errors=True)
+    finally:
+        if tmp_path is not None:
+            shutil.rmtree(tmp_path)
+    return manifest
+
+
+def unload(name, store=None):
+    """Removes a set from the store. Attached processes keep their mappings.
+
+    Raises:
+        KeyError: if there is no set of that name
+    """
+    path = _set_dir(name, store)
+    if not os.path.isdir(path):
+        raise KeyError(name)
+    version_path = os.path.realpath(path)
+    if version_path != path:
+        os.remove(path)
+    shutil.rmtree(version_path, ignore_errors=True)
+
+
+def resident(store=None):
+    """Return the manifests of the sets in the store, each with the "bytes"
+        of its files, sorted by name."""
+    store = store or default_store()
+    if not os.path.isdir(store):
+        return []
+    manifests = []
+    for name in sorted(os.listdir(store)):
+        path = os.path.join(store, name)
+        if name.startswith(".") or not os.path.isfile(
+                os.path.join(path, MANIFEST)):
+            continue
+        with open(os.path.join(path, MANIFEST)) as f:
+            manifest = json.load(f)
+        manifest["bytes"] = sum(os.path.getsize(os.path.join(path, filename))
+                                for filename in os.listdir(path))
+        manifests.append(manifest)
+    return manifests
+
+
+def attach(name, langs=None, store=None):
+    """Memory-maps the models of a set, without copying their tables.
+
+    Args:
+        name (str): name of the set
+        langs (list<str>, optional): languages to return the models of, in
+            this order. Defaults to all the models of the set.
+        store (str, optional): store directory. Defaults to default_store().
+
+    Return:
+        tuple<list<CNGram>, Lexicon>: the models, and the lexicon of the set
+            or None
+
+    Raises:
+        KeyError: if there is no set of that name
+        ValueError: if the set has no model of one of langs
+    """
+    # Read every file from the same version, even if a new one is loaded
+    # meanwhile; retry if the version is removed before it is mapped
+    link = _set_dir(name, store)
+    while True:
+        path = os.path.realpath(link)
+        try:
+            return _attach_version(path, name, langs)
+        except FileNotFoundError:
+            if not os.path.islink(link):
+                raise KeyError(name) from None
+            if os.path.realpath(link) == path:
+                raise
+
+
+def _attach_version(path, name, langs):
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+
+    files = {model["lang"]: model["file"] for model in manifest["models"]}
+    if langs is None:
+        langs = [model["lang"] for model in manifest["models"]]
+    missing = [lang for lang in langs if lang not in files]
+    if missing:
+        raise ValueError("Model set {} has no model of {}".format(
+            name, ", ".join(missing)))
+    models = [CNGram.load(os.path.join(path, files[lang])) for lang in langs]
+
+    lexicon = None
+    if manifest["lexicon"]:
+        lexicon = read_lexicon(os.path.join(path, manifest["lexicon"]))
+    return models, lexicon
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Keep language models resident in shared memory for "
+                        "evaluator.py --attach")
+    parser.add_argument(
+            "--store",
+            type=str,
+            default=None,
+            help="store directory (Default: {})".format(default_store()))
+    commands = parser.add_subparsers(dest="command")
+    command = commands.add_parser(
+            "load",
+            help="copy model files into the store as a named set")
+    command.add_argument(
+            "name",
+            type=str,
+            help="name of the set")
+    command.add_argument(
+            "model",
+            nargs="+",
+            type=str,
+            help="model files in the model directory, one per language")
+    command.add_argument(
+            "--lexicon",
+            type=str,
+            default=None,
+            help="lexicon file built from these models (Default: none)")
+    command = commands.add_parser(
+            "unload",
+            help="remove a set from the store")
+    command.add_argument(
+            "name",
+            type=str,
+            help="name of the set")
+    commands.add_parser(
+            "list",
+            help="list the sets in the store")
+    args = parser.parse_args()
+
+    if args.command == "load":
+        manifest = load(args.name, args.model, args.lexicon, args.store)
+        print("Loaded {} ({})".format(args.name, ", ".join(
+            model["lang"] for model in manifest["models"])))
+    elif args.command == "unload":
+        try:
+            unload(args.name, args.store)
+        except KeyError:
+            parser.error("no model set named {}".format(args.name))
+        print("Unloaded {}".format(args.name))
+    elif args.command == "list":
+        for manifest in resident(args.store):
+            print("{}\t{}\t{}\t{}".format(
+                manifest["name"],
+                ",".join(model["lang"] for model in manifest["models"]),
+                "lexicon" if manifest["lexicon"] else "-",
+                manifest["bytes"]))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#  ner.py
+#  Using Python 3.4.3
+
+import time
+import atexit
+import socket
+import subprocess
+import threading
+
+
+NER_BACKENDS = ("server", "nltk", "none")
+
+
+def get_ner_tagger(classifier, local_config):
+    """Creates the Named Entity Recognizer for one classifier.
+
+    Args:
+        classifier (str): Path to the Stanford NER classifier
+        local_config (dict<str>): Configuration options; ner_backend selects
+            between a persistent NER server ("server", the default),
+            NLTK's wrapper, which starts Java for every call ("nltk"), and
+            no recognition at all ("none").
+
+    Return:
+        object: A tagger with a tag(tokens) method returning (token, tag)
+            pairs
+    """
+    backend = local_config.get("ner_backend", "server")
+    if backend == "server":
+        return NERServer(classifier, local_config["class_jar"])
+    if backend == "nltk":
+        # Imported here, as importing NLTK takes longer than the rest of
+        # the tagger put together
+        from nltk.tag.stanford import StanfordNERTagger
+        return StanfordNERTagger(classifier, local_config["class_jar"])
+    if backend == "none":
+        return NullNERTagger()
+    raise ValueError("Unknown NER backend: {}".format(backend))
+
+
+class NullNERTagger:
+    """Named Entity Recognizer that finds no entities, for runs that only
+        identify languages."""
+
+    def tag(self, tokens):
+        return [(token, "O") for token in tokens]
+
+
+class NERClient:
+    """Client of a running Stanford NER socket server.
+
+    The server reads one line of whitespace-tokenized text per connection and
+        answers with the tokens in slashTags format ("token/TAG"). At most
+        max_connections requests are in flight at once.
+
+    Args:
+        host (str): Host of the server
+        port (int): Port of the server
+        max_connections (int, optional): Maximum concurrent connections. The
+            default is 4.
+        timeout (float, optional): Socket timeout in seconds. The default is
+            300.
+    """
+
+    def __init__(self, host, port, max_connections=4, timeout=300):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._pool = threading.BoundedSemaphore(max_connections)
+
+    def tag(self, tokens):
+        """Tags a list of tokens with named entity labels.
+
+        Args:
+            tokens (list<str>): Tokens without whitespace
+
+        Return:
+            list<tuple<str, str>>: (token, tag) for every token
+        """
+        if not tokens:
+            return []
+
+        request = (" ".join(tokens) + "\n").encode("utf-8")
+        with self._pool:
+            with socket.create_connection((self.host, self.port),
+                                          self.timeout) as conn:
+                conn.sendall(request)
+                conn.shutdown(socket.SHUT_WR)
+                response = b"".join(iter(lambda: conn.recv(1 << 16), b""))
+
+        tagged = [tuple(item.rsplit("/", 1))
+                  for item in response.decode("utf-8").split()]
+        if len(tagged) != len(tokens):
+            raise RuntimeError("NER server at {}:{} returned {} tags for {} "
+                               "tokens".format(self.host, self.port,
+                                               len(tagged), len(tokens)))
+        return tagged
+
+
+class NERServer(NERClient):
+    """Stanford NER socket server for one classifier, launched once and
+        reused for every call until it is closed. The server is shut down
+        at interpreter exit if it is still running.
+
+    Args:
+        classifier (str): Path to the Stanford NER classifier
+        jar (str): Path to the Stanford NER .jar file
+        port (int, optional): Port to listen on; 0 picks a free port. The
+            default is 0.
+        java (str, optional): Java executable. The default is "java".
+        memory (str, optional): Maximum heap of the JVM. The default is
+            "1000m".
+        startup_timeout (float, optional): Seconds to wait for the classifier
+            to load. The default is 300.
+    """
+
+    def __init__(self, classifier, jar, port=0, java="java", memory="1000m",
+                 startup_timeout=300):
+        if port == 0:
+            with socket.socket() as probe:
+                probe.bind(("localhost", 0))
+                port = probe.getsockname()[1]
+        super().__init__("localhost", port)
+
+        self.process = subprocess.Popen(
+            [java, "-mx" + memory, "-cp", jar,
+             "edu.stanford.nlp.ie.NERServer",
+             "-loadClassifier", classifier,
+             "-port", str(port),
+             "-encoding", "utf-8",
+             "-outputFormat", "slashTags",
+             "-tokenizerFactory", "edu.stanford.nlp.process.WhitespaceTokenizer",
+             "-tokenizerOptions", "tokenizeNLs=false"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        atexit.register(self.close)
+        self._wait_until_ready(startup_timeout)
+
+    def _wait_until_ready(self, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("NER server exited with code {}".format(
+                    self.process.returncode))
+            try:
+                socket.create_connection((self.host, self.port), 1).close()
+                return
+            except OSError:
+                time.sleep(0.5)
+        self.close()
+        raise RuntimeError("NER server did not start within {} seconds"
+                           .format(timeout))
+
+    def close(self):
+        """Shuts the server down."""
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
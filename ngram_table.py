@@ -0,0 +1,749 @@
+#  ngram_table.py
+#  Using Python 3.4.3
+
+import os
+import sys
+import math
+import mmap
+import zlib
+import struct
+from array import array
+from bisect import bisect_left
+from collections import defaultdict, Counter
+from collections.abc import Mapping
+
+
+"""Binary model file layout (all sections padded to 8 bytes):
+
+    header      magic, version, byte order, quantization bits, n,
+                num_letters, number of contexts, number of entries, size of
+                the codebook and the language name
+    keys        sorted contexts, each n-1 code points in UTF-32-BE so that
+                byte order equals string order
+    offsets     (contexts + 1) uint32, start of each context's entries
+    chars       uint32 code point of the last character of each entry
+    logprobs    float64 log P(char | context) of each entry, or its uint8 or
+                uint16 code if the table is quantized
+    codebook    only if quantized: float64 log probability of each code
+    backoffs    float64 log P of an unseen character after each context
+    counts      only if not quantized: uint32 raw count of each entry
+
+    Hashed tables (HASHED_MAGIC) have the same header, with the number of
+        buckets in place of the number of contexts, depth * buckets entries
+        and the depth as the size of the codebook, followed by:
+
+    types       uint32 number of distinct last characters per context bucket
+    counts      uint32 n-gram counts, one row of buckets per hash function
+
+    The table may be followed by any number of update segments appended by
+        append_counts, each holding the n-gram counts of new training text:
+
+    segment     magic and number of records
+    records     per n-gram, its n uint32 code points and its uint32 count
+"""
+MAGIC = b"CNGR"
+HASHED_MAGIC = b"CNGH"
+VERSION = 4
+HEADER = struct.Struct("<4sHcBIIIIII")
+SEGMENT_MAGIC = b"CNGU"
+SEGMENT = struct.Struct("<4sI")
+ALIGN = 8
+
+
+def _pad(size):
+    return -size % ALIGN
+
+
+class DictCondProbs(dict):
+    """Context -> last character -> log probability table held in nested
+        dictionaries, with the log probability of an unseen last character
+        and the raw counts kept per context.
+
+    Properties:
+        backoffs (dict<str, float>): log P of an unseen character per context
+        counts (dict<str, Counter>): raw last character counts per context
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.backoffs = {}
+        self.counts = {}
+
+    def logprob(self, ctx, c, unseen):
+        """Return log P(c | ctx), or unseen if ctx was never seen."""
+        cnts = self.get(ctx)
+        if cnts is None:
+            return unseen
+        return cnts.get(c, self.backoffs[ctx])
+
+    def backoff(self, ctx):
+        return self.backoffs[ctx]
+
+    def row_counts(self, ctx):
+        """Return the raw last character counts of a context."""
+        return self.counts.get(ctx, {})
+
+    def set_row(self, ctx, cnts, num_letters):
+        """Stores the counts of a context and their add-one smoothed log
+            probabilities.
+
+        Args:
+            ctx (str): The context
+            cnts (Counter<str, int>): Count of each last character
+            num_letters (int): Smoothing constant of the model
+        """
+        denom = math.log(len(cnts) + num_letters)
+        self[ctx] = {lastc: math.log(cnt + 1) - denom
+                     for lastc, cnt in cnts.items()}
+        self.backoffs[ctx] = -denom
+        self.counts[ctx] = cnts
+
+    def add_counts(self, cond_cnts, num_letters):
+        """Adds new counts, renormalizing only the contexts they touch.
+
+        Args:
+            cond_cnts (dict<str, dict<str, int>>): Counts to add
+            num_letters (int): Smoothing constant of the model
+        """
+        for ctx, cnts in cond_cnts.items():
+            merged = Counter(self.row_counts(ctx))
+            merged.update(cnts)
+            self.set_row(ctx, merged, num_letters)
+
+
+class PackedCondProbs(Mapping):
+    """Read-only conditional probability table stored in flat buffers.
+
+    Contexts are kept sorted in a single byte buffer and resolved by binary
+        search, so no Python object is created per context or per entry until
+        it is looked up. The buffers may be plain arrays or views over a
+        memory-mapped model file.
+
+    Args:
+        keys (bytes or mmap): sorted, fixed-width UTF-32-BE contexts
+        width (int): number of characters in a context
+        offsets (sequence<int>): start index of the entries of each context
+        chars (sequence<int>): code points of the last characters
+        logprobs (sequence<float>): log P(char | context) for each entry
+        backoffs (sequence<float>): log P of an unseen character per context
+        counts (sequence<int>): raw count of each entry
+    """
+
+    def __init__(self, keys, width, offsets, chars, logprobs, backoffs,
+                 counts):
+        self.keys = keys
+        self.width = width
+        self.offsets = offsets
+        self.chars = chars
+        self.logprobs = logprobs
+        self.backoffs = backoffs
+        self.counts = counts
+        self._stride = 4 * width
+        self._size = len(offsets) - 1
+
+    def find(self, ctx):
+        """Return the index of a context, or -1 if it was never seen."""
+        if len(ctx) != self.width:
+            return -1
+        key = ctx.encode("utf-32-be")
+        stride = self._stride
+        lo, hi = 0, self._size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.keys[mid * stride:(mid + 1) * stride] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._size and self.keys[lo * stride:(lo + 1) * stride] == key:
+            return lo
+        return -1
+
+    def logprob(self, ctx, c, unseen):
+        """Return log P(c | ctx), or unseen if ctx was never seen."""
+        index = self.find(ctx)
+        if index < 0:
+            return unseen
+        chars = self.chars
+        code = ord(c)
+        stop = self.offsets[index + 1]
+        i = bisect_left(chars, code, self.offsets[index], stop)
+        if i < stop and chars[i] == code:
+            return self.logprobs[i]
+        return self.backoffs[index]
+
+    def backoff(self, ctx):
+        index = self.find(ctx)
+        if index < 0:
+            raise KeyError(ctx)
+        return self.backoffs[index]
+
+    def row_counts(self, ctx):
+        """Return the raw last character counts of a context."""
+        index = self.find(ctx)
+        if index < 0:
+            return {}
+        return {chr(self.chars[i]): self.counts[i]
+                for i in range(self.offsets[index], self.offsets[index + 1])}
+
+    def value(self, i):
+        """Return the log probability of the i-th entry."""
+        return self.logprobs[i]
+
+    def context(self, index):
+        stride = self._stride
+        return self.keys[index * stride:(index + 1) * stride].decode("utf-32-be")
+
+    def __getitem__(self, ctx):
+        index = self.find(ctx)
+        if index < 0:
+            raise KeyError(ctx)
+        return _PackedRow(self, index)
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        return (self.context(i) for i in range(self._size))
+
+
+class _PackedRow(Mapping):
+    """Last character -> log probability mapping for one context."""
+
+    def __init__(self, table, index):
+        self.table = table
+        self.start = table.offsets[index]
+        self.stop = table.offsets[index + 1]
+
+    def __getitem__(self, c):
+        if len(c) != 1:
+            raise KeyError(c)
+        chars = self.table.chars
+        code = ord(c)
+        i = bisect_left(chars, code, self.start, self.stop)
+        if i == self.stop or chars[i] != code:
+            raise KeyError(c)
+        return self.table.value(i)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __iter__(self):
+        return (chr(self.table.chars[i]) for i in range(self.start, self.stop))
+
+
+class QuantizedCondProbs(PackedCondProbs):
+    """Packed table whose log probabilities are stored as 8 or 16-bit codes
+        into a codebook. Quantized tables keep no raw counts, so they can
+        neither be updated nor pruned.
+
+    Args:
+        keys, width, offsets, chars, backoffs: See PackedCondProbs
+        codes (sequence<int>): codebook index of each entry
+        codebook (sequence<float>): log probability of each code
+        bits (int): 8 or 16
+    """
+
+    def __init__(self, keys, width, offsets, chars, codes, codebook,
+                 backoffs, bits):
+        super().__init__(keys, width, offsets, chars, codes, backoffs, None)
+        self.codebook = codebook
+        self.bits = bits
+
+    def logprob(self, ctx, c, unseen):
+        """Return log P(c | ctx), or unseen if ctx was never seen."""
+        index = self.find(ctx)
+        if index < 0:
+            return unseen
+        chars = self.chars
+        code = ord(c)
+        stop = self.offsets[index + 1]
+        i = bisect_left(chars, code, self.offsets[index], stop)
+        if i < stop and chars[i] == code:
+            return self.codebook[self.logprobs[i]]
+        return self.backoffs[index]
+
+    def row_counts(self, ctx):
+        raise ValueError("Quantized n-gram tables keep no counts")
+
+    def value(self, i):
+        """Return the log probability of the i-th entry."""
+        return self.codebook[self.logprobs[i]]
+
+
+def build_codebook(values, levels):
+    """Chooses at most levels log probabilities that stand in for values:
+        the distinct values if there are few enough. Otherwise half of the
+        levels are the means of bins holding equally many values, which
+        keeps the average error small, and half are spread evenly over the
+        range of values, which bounds the error of rare values.
+
+    Args:
+        values (sequence<float>): The log probabilities to quantize
+        levels (int): Maximum size of the codebook
+
+    Return:
+        list<float>: The codebook, in increasing order
+    """
+    distinct = sorted(Counter(values).items())
+    if len(distinct) <= levels:
+        return [value for value, _ in distinct]
+
+    half = levels // 2
+    codebook = []
+    seen = bin_sum = bin_size = 0
+    for value, count in distinct:
+        bin_sum += value * count
+        bin_size += count
+        seen += count
+        if seen * half >= len(values) * (len(codebook) + 1):
+            codebook.append(bin_sum / bin_size)
+            bin_sum = bin_size = 0
+    if bin_size:
+        codebook.append(bin_sum / bin_size)
+
+    lo, hi = distinct[0][0], distinct[-1][0]
+    codebook += [lo + (hi - lo) * k / (levels - half - 1)
+                 for k in range(levels - half)]
+    return sorted(set(codebook))
+
+
+def quantize_cond_probs(cond_probs, width, bits):
+    """Pack a table, replacing each log probability with the nearest entry
+        of a codebook of 2^bits values.
+
+    Args:
+        cond_probs (DictCondProbs, PackedCondProbs or OverlayCondProbs):
+            normalized log probabilities
+        width (int): number of characters in a context (n - 1)
+        bits (int): 8 or 16
+
+    Return:
+        QuantizedCondProbs: the quantized table
+    """
+    if bits not in (8, 16):
+        raise ValueError("Can only quantize to 8 or 16 bits, not {}".format(
+            bits))
+    if isinstance(cond_probs, QuantizedCondProbs):
+        if cond_probs.bits != bits:
+            raise ValueError("Table is already quantized to {} bits".format(
+                cond_probs.bits))
+        return cond_probs
+
+    table = pack_cond_probs(cond_probs, width)
+    codebook = build_codebook(table.logprobs, 1 << bits)
+    # Each value gets the code of the nearest codebook entry
+    bounds = [(lo + hi) / 2 for lo, hi in zip(codebook, codebook[1:])]
+    code_of = {value: bisect_left(bounds, value)
+               for value in set(table.logprobs)}
+    codes = array("B" if bits == 8 else "H",
+                  (code_of[value] for value in table.logprobs))
+    codebook = array("d", codebook)
+    return QuantizedCondProbs(table.keys, width, table.offsets, table.chars,
+                              codes, codebook, table.backoffs, bits)
+
+
+class HashedCondProbs:
+    """Conditional probability table of fixed size, whose contexts and
+        n-grams are hashed into 2 ** bits buckets instead of being stored.
+        Its memory does not depend on the number of distinct n-grams, at the
+        cost of collisions: n-grams sharing a bucket add up their counts, and
+        contexts sharing one add up their numbers of last characters, which
+        both skew the smoothed probabilities.
+
+    With a depth above 1, the n-gram counts are a count-min sketch: every
+        n-gram is counted in one bucket of each of depth rows, and its count
+        is the smallest of them, which only exceeds the true count if it
+        collides in every row.
+
+    Contexts and characters cannot be listed back, so hashed tables cannot
+        be pruned, packed or quantized; they can be updated.
+
+    Args:
+        bits (int): log2 of the number of buckets
+        depth (int): number of hash functions (rows) of the n-gram counts
+        num_letters (int): smoothing constant of the model
+        types (sequence<int>, optional): number of distinct last characters
+            per context bucket. Defaults to zeros.
+        counts (sequence<int>, optional): depth rows of n-gram counts.
+            Defaults to zeros.
+    """
+
+    def __init__(self, bits, depth, num_letters, types=None, counts=None):
+        size = 1 << bits
+        self.bits = bits
+        self.depth = depth
+        self.num_letters = num_letters
+        self.types = array("I", bytes(4 * size)) if types is None else types
+        self.counts = (array("I", bytes(4 * size * depth)) if counts is None
+                       else counts)
+        self._size = size
+        self._mask = size - 1
+
+    def _context(self, ctx):
+        return zlib.crc32(ctx.encode("utf-8")) & self._mask
+
+    def _buckets(self, ctx, c):
+        """Return the bucket of an n-gram in every row of counts. Rows past
+            the first combine two hashes of the n-gram (double hashing)."""
+        key = (ctx + c).encode("utf-8")
+        h1 = zlib.crc32(key)
+        if self.depth == 1:
+            return (h1 & self._mask,)
+        h2 = zlib.crc32(key[::-1]) | 1
+        size, mask = self._size, self._mask
+        return [row * size + ((h1 + row * h2) & mask)
+                for row in range(self.depth)]
+
+    def count(self, ctx, c):
+        """Return the (over)estimated count of an n-gram."""
+        counts = self.counts
+        return min(counts[i] for i in self._buckets(ctx, c))
+
+    def add(self, ctx, c, cnt=1):
+        """Counts an n-gram cnt more times."""
+        buckets = self._buckets(ctx, c)
+        counts = self.counts
+        if min(counts[i] for i in buckets) == 0:
+            self.types[self._context(ctx)] += 1
+        for i in buckets:
+            counts[i] += cnt
+
+    def add_words(self, words, n):
+        """Counts the n-grams of words, padded as by get_ngrams, without
+            holding them in a dictionary first."""
+        pad = " " * (n - 1)
+        add = self.add
+        for word in words:
+            word = pad + word + pad
+            for i in range(len(word) - n + 1):
+                add(word[i:i + n - 1], word[i + n - 1])
+
+    def logprob(self, ctx, c, unseen):
+        """Return log P(c | ctx), or unseen if ctx was never seen."""
+        types = self.types[self._context(ctx)]
+        if not types:
+            return unseen
+        return (math.log(self.count(ctx, c) + 1) -
+                math.log(types + self.num_letters))
+
+    def backoff(self, ctx):
+        return -math.log(self.types[self._context(ctx)] + self.num_letters)
+
+    def add_counts(self, cond_cnts, num_letters):
+        """Adds new counts, see DictCondProbs.add_counts."""
+        for ctx, cnts in cond_cnts.items():
+            for c, cnt in cnts.items():
+                self.add(ctx, c, cnt)
+
+    def writable(self):
+        """Return this table, or a copy in memory if it is memory-mapped."""
+        if isinstance(self.types, array):
+            return self
+        return HashedCondProbs(self.bits, self.depth, self.num_letters,
+                               array("I", self.types),
+                               array("I", self.counts))
+
+    def __len__(self):
+        """Return the number of context buckets in use."""
+        return self._size - self.types.tolist().count(0)
+
+
+class OverlayCondProbs(Mapping):
+    """Packed table whose updated contexts are held in a DictCondProbs on
+        top of it, so that a read-only or memory-mapped table can take new
+        counts without being repacked.
+
+    Args:
+        base (PackedCondProbs): the table being updated
+
+    Properties:
+        base (PackedCondProbs): the table being updated
+        overlay (DictCondProbs): the updated contexts
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.overlay = DictCondProbs()
+        self._added = 0
+
+    def logprob(self, ctx, c, unseen):
+        """Return log P(c | ctx), or unseen if ctx was never seen."""
+        cnts = self.overlay.get(ctx)
+        if cnts is None:
+            return self.base.logprob(ctx, c, unseen)
+        return cnts.get(c, self.overlay.backoffs[ctx])
+
+    def backoff(self, ctx):
+        if ctx in self.overlay:
+            return self.overlay.backoffs[ctx]
+        return self.base.backoff(ctx)
+
+    def row_counts(self, ctx):
+        """Return the raw last character counts of a context."""
+        if ctx in self.overlay:
+            return self.overlay.counts[ctx]
+        return self.base.row_counts(ctx)
+
+    def add_counts(self, cond_cnts, num_letters):
+        """Adds new counts, renormalizing only the contexts they touch.
+            See DictCondProbs.add_counts.
+        """
+        for ctx, cnts in cond_cnts.items():
+            if ctx not in self.overlay and self.base.find(ctx) < 0:
+                self._added += 1
+            merged = Counter(self.row_counts(ctx))
+            merged.update(cnts)
+            self.overlay.set_row(ctx, merged, num_letters)
+
+    def __getitem__(self, ctx):
+        if ctx in self.overlay:
+            return self.overlay[ctx]
+        return self.base[ctx]
+
+    def __len__(self):
+        return len(self.base) + self._added
+
+    def __iter__(self):
+        yield from self.base
+        for ctx in self.overlay:
+            if self.base.find(ctx) < 0:
+                yield ctx
+
+
+def pack_cond_probs(cond_probs, width):
+    """Pack a context -> last character -> log probability table into flat
+        buffers. Each context is interned as its index in the sorted key
+        buffer.
+
+    Args:
+        cond_probs (DictCondProbs or OverlayCondProbs): normalized log
+            probabilities
+        width (int): number of characters in a context (n - 1)
+
+    Return:
+        PackedCondProbs: the packed table
+    """
+    if isinstance(cond_probs, PackedCondProbs):
+        return cond_probs
+
+    keys = bytearray()
+    offsets = array("I", [0])
+    chars = array("I")
+    logprobs = array("d")
+    backoffs = array("d")
+    counts = array("I")
+
+    for ctx in sorted(cond_probs):
+        keys += ctx.encode("utf-32-be")
+        row_counts = cond_probs.row_counts(ctx)
+        for c, p in sorted(cond_probs[ctx].items()):
+            chars.append(ord(c))
+            logprobs.append(p)
+            counts.append(row_counts[c])
+        offsets.append(len(chars))
+        backoffs.append(cond_probs.backoff(ctx))
+
+    return PackedCondProbs(bytes(keys), width, offsets, chars, logprobs,
+                           backoffs, counts)
+
+
+def updatable(cond_probs):
+    """Return a table that supports add_counts: DictCondProbs and
+        OverlayCondProbs as they are, a packed table wrapped in an overlay.
+    """
+    if isinstance(cond_probs, QuantizedCondProbs):
+        raise ValueError("Quantized n-gram tables cannot be updated")
+    if isinstance(cond_probs, HashedCondProbs):
+        return cond_probs.writable()
+    if isinstance(cond_probs, PackedCondProbs):
+        return OverlayCondProbs(cond_probs)
+    return cond_probs
+
+
+def write_table(path, lang, n, num_letters, cond_probs):
+    """Write a context -> last character -> log probability table to a
+        binary model file. The file is replaced atomically, so models
+        memory-mapped from an older version of it stay readable.
+
+    Args:
+        path (str): destination file
+        lang (str): language of the model
+        n (int): length of the n-grams
+        num_letters (int): smoothing constant of the model
+        cond_probs (DictCondProbs, PackedCondProbs, QuantizedCondProbs,
+            OverlayCondProbs or HashedCondProbs): normalized log
+            probabilities
+    """
+    byteorder = b"<" if sys.byteorder == "little" else b">"
+    name = lang.encode("utf-8")
+
+    if isinstance(cond_probs, HashedCondProbs):
+        table = cond_probs
+        header = HEADER.pack(HASHED_MAGIC, VERSION, byteorder, 0, n,
+                             num_letters, len(table.types),
+                             len(table.counts), table.depth,
+                             len(name)) + name
+        sections = (header, table.types, table.counts)
+    else:
+        table = pack_cond_probs(cond_probs, n - 1)
+        if isinstance(table, QuantizedCondProbs):
+            bits, levels = table.bits, len(table.codebook)
+            values = (table.logprobs, table.codebook, table.backoffs)
+        else:
+            bits = levels = 0
+            values = (table.logprobs, table.backoffs, table.counts)
+        header = HEADER.pack(MAGIC, VERSION, byteorder, bits, n, num_letters,
+                             len(table), len(table.chars), levels,
+                             len(name)) + name
+        keys = table.keys[0:len(table.keys)]
+        sections = (header, keys, table.offsets, table.chars) + values
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, mode="wb") as out:
+        for data in sections:
+            data = bytes(data)
+            out.write(data)
+            out.write(b"\0" * _pad(len(data)))
+    os.replace(tmp_path, path)
+
+
+def _check_header(buf, path):
+    magic, version, byteorder, bits, n, num_letters, num_ctx, num_entries, \
+        levels, name_len = HEADER.unpack_from(buf, 0)
+    if magic not in (MAGIC, HASHED_MAGIC) or version != VERSION:
+        raise ValueError("{} is not a version {} model file".format(
+            path, VERSION))
+    if byteorder != (b"<" if sys.byteorder == "little" else b">"):
+        raise ValueError("{} was written on a machine with a different "
+                         "byte order".format(path))
+    return (bits, n, num_letters, num_ctx, num_entries, levels, name_len,
+            magic == HASHED_MAGIC)
+
+
+def append_counts(path, cond_cnts):
+    """Append the n-gram counts of new training text to a model file as an
+        update segment, without rewriting the table. read_table returns the
+        segments, to be applied on top of the table.
+
+    Args:
+        path (str): model file written by write_table
+        cond_cnts (dict<str, dict<str, int>>): counts to append, see
+            get_cond_cnts
+    """
+    with open(path, mode="rb") as f:
+        bits, n = _check_header(f.read(HEADER.size), path)[:2]
+    if bits:
+        raise ValueError("{} is quantized and cannot be updated".format(path))
+
+    records = array("I")
+    for ctx, cnts in sorted(cond_cnts.items()):
+        head = [ord(c) for c in ctx]
+        for c, cnt in sorted(cnts.items()):
+            records.extend(head)
+            records.append(ord(c))
+            records.append(cnt)
+
+    data = bytes(records)
+    with open(path, mode="ab") as out:
+        out.write(SEGMENT.pack(SEGMENT_MAGIC, len(records) // (n + 1)))
+        out.write(data)
+        out.write(b"\0" * _pad(len(data)))
+
+
+def read_table(path):
+    """Memory-map a binary model file written by write_table.
+
+    Return:
+        tuple<str, int, int, PackedCondProbs, list<defaultdict>>: the
+            language, n-gram length, smoothing constant, the probability
+            table (a QuantizedCondProbs if it was quantized, a
+            HashedCondProbs if it was hashed) and the counts of each update
+            segment appended since
+    """
+    with open(path, mode="rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    bits, n, num_letters, num_ctx, num_entries, levels, name_len, hashed = \
+        _check_header(buf, path)
+
+    pos = HEADER.size
+    lang = buf[pos:pos + name_len].decode("utf-8")
+    pos += name_len + _pad(HEADER.size + name_len)
+
+    view = memoryview(buf)
+    if hashed:
+        types = view[pos:pos + 4 * num_ctx].cast("I")
+        pos += 4 * num_ctx + _pad(4 * num_ctx)
+        counts = view[pos:pos + 4 * num_entries].cast("I")
+        pos += 4 * num_entries + _pad(4 * num_entries)
+        table = HashedCondProbs(num_ctx.bit_length() - 1, levels, num_letters,
+                                types, counts)
+        return lang, n, num_letters, table, _read_segments(buf, pos, n, path)
+
+    keys_size = 4 * (n - 1) * num_ctx
+    keys = MappedBytes(buf, pos, keys_size)
+    pos += keys_size + _pad(keys_size)
+
+    if bits:
+        layout = (("I", num_ctx + 1), ("I", num_entries),
+                  ("B" if bits == 8 else "H", num_entries), ("d", levels),
+                  ("d", num_ctx))
+    else:
+        layout = (("I", num_ctx + 1), ("I", num_entries), ("d", num_entries),
+                  ("d", num_ctx), ("I", num_entries))
+
+    sections = []
+    for fmt, count in layout:
+        size = array(fmt).itemsize * count
+        sections.append(view[pos:pos + size].cast(fmt))
+        pos += size + _pad(size)
+
+    if bits:
+        table = QuantizedCondProbs(keys, n - 1, *sections, bits=bits)
+    else:
+        table = PackedCondProbs(keys, n - 1, *sections)
+    return lang, n, num_letters, table, _read_segments(buf, pos, n, path)
+
+
+def _read_segments(buf, pos, n, path):
+    """Return the counts of the update segments from pos to the end."""
+    updates = []
+    while pos < len(buf):
+        if pos + SEGMENT.size > len(buf):
+            raise ValueError("{} has a truncated update segment at byte {}"
+                             .format(path, pos))
+        magic, num_records = SEGMENT.unpack_from(buf, pos)
+        if magic != SEGMENT_MAGIC:
+            raise ValueError("{} has a corrupt update segment at byte {}"
+                             .format(path, pos))
+        size = 4 * (n + 1) * num_records
+        if pos + SEGMENT.size + size > len(buf):
+            raise ValueError("{} has a truncated update segment at byte {}"
+                             .format(path, pos))
+        pos += SEGMENT.size
+        records = array("I", buf[pos:pos + size])
+        pos += size + _pad(size)
+
+        cond_cnts = defaultdict(Counter)
+        for i in range(0, len(records), n + 1):
+            ctx = "".join(map(chr, records[i:i + n - 1]))
+            cond_cnts[ctx][chr(records[i + n - 1])] += records[i + n]
+        updates.append(cond_cnts)
+    return updates
+
+
+class MappedBytes:
+    """Window over an mmap whose slices are returned as bytes, so that
+        contexts can be compared without copying the whole key section.
+    """
+
+    def __init__(self, buf, start, size):
+        self.buf = buf
+        self.start = start
+        self.size = size
+
+    def __getitem__(self, key):
+        return self.buf[self.start + key.start:self.start + key.stop]
+
+    def __len__(self):
+        return self.size
@@ -0,0 +1,148 @@
+#  profiling.py
+#  Using Python 3.4.3
+
+import json
+import time
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+
+class Profiler:
+    """Collects wall time and call counts per stage, plus named counters,
+        for a structured report of where a run spends its time.
+
+    Stages may be timed from several threads; times of concurrent calls are
+        summed.
+
+    Args:
+        trace_memory (bool, optional): Track peak memory with tracemalloc,
+            which slows Python down noticeably. The default is False.
+
+    Properties:
+        seconds (Counter<str, float>): Total seconds spent in each stage
+        calls (Counter<str, int>): Number of times each stage ran
+        counters (Counter<str, int>): Named counts, e.g. tokens tagged
+    """
+
+    def __init__(self, trace_memory=False):
+        self.seconds = Counter()
+        self.calls = Counter()
+        self.counters = Counter()
+        self.trace_memory = trace_memory
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        if trace_memory:
+            tracemalloc.start()
+
+    def add(self, stage, seconds, calls=1):
+        """Adds the time of calls to a stage."""
+        with self._lock:
+            self.seconds[stage] += seconds
+            self.calls[stage] += calls
+
+    def count(self, name, amount=1):
+        """Adds amount to a named counter."""
+        with self._lock:
+            self.counters[name] += amount
+
+    def merge(self, seconds, calls, counters):
+        """Adds the measurements of another profiler, e.g. one that ran in
+            a worker process."""
+        with self._lock:
+            self.seconds.update(seconds)
+            self.calls.update(calls)
+            self.counters.update(counters)
+
+    def iterate(self, stage, iterable):
+        """Yields the items of iterable, timing the production of the items
+            as one call to a stage."""
+        total = 0.0
+        items = iter(iterable)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                finally:
+                    total += time.perf_counter() - start
+                yield item
+        finally:
+            self.add(stage, total)
+
+    @contextmanager
+    def stage(self, name):
+        """Times the enclosed block as one call to a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def report(self, cs_model=None):
+        """Return the collected measurements.
+
+        Args:
+            cs_model (CodeSModel, optional): Model whose emission cache
+                statistics are included
+
+        Return:
+            dict: wall_seconds, tokens_per_second, stages (seconds and calls
+                per stage), counters, emission_cache and peak_memory_mb
+        """
+        wall = time.perf_counter() - self._start
+        report = {
+            "wall_seconds": wall,
+            "tokens_per_second": self.counters["tokens"] / wall,
+            "stages": {stage: {"seconds": self.seconds[stage],
+                               "calls": self.calls[stage]}
+                       for stage in sorted(self.seconds)},
+            "counters": dict(self.counters),
+        }
+        if cs_model is not None:
+            info = cs_model.cache_info()
+            lookups = info.hits + info.misses
+            report["emission_cache"] = dict(
+                info._asdict(), hit_rate=info.hits / lookups if lookups else 0)
+        if self.trace_memory and tracemalloc.is_tracing():
+            report["peak_memory_mb"] = \
+                tracemalloc.get_traced_memory()[1] / 2.0 ** 20
+        return report
+
+    def write_report(self, path, cs_model=None):
+        """Writes the report to a JSON file."""
+        with open(path, mode="w") as out:
+            json.dump(self.report(cs_model), out, indent=2)
+
+
+@contextmanager
+def cprofiled(path, top=0):
+    """Runs the enclosed block under cProfile and dumps the statistics to
+        path, readable with pstats or snakeviz. If path is empty, the block
+        runs unprofiled.
+
+    Args:
+        path (str): Destination of the statistics
+        top (int, optional): Also print this many functions with the highest
+            cumulative time. The default is 0.
+    """
+    if not path:
+        yield
+        return
+
+    # Imported here, as pstats takes longer to import than everything else
+    # the tagger needs to start
+    import pstats
+    import cProfile
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
+        if top:
+            pstats.Stats(profile).sort_stats("cumulative").print_stats(top)
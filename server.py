@@ -0,0 +1,184 @@
+#  server.py
+#  Using Python 3.4.3
+
+import json
+import queue
+import threading
+from concurrent.futures import Future
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from tokenizer import split_words
+
+
+class TagBatcher:
+    """Coalesces concurrent tagging requests into batches, so that many
+        small inputs share calls to the Named Entity Recognizers.
+
+    A worker takes the oldest pending request, then keeps collecting
+        requests for up to max_wait seconds or until max_tokens tokens are
+        gathered, and tags them all with one Evaluator.tag_batch call.
+
+    Args:
+        evaluator (Evaluator): The loaded models
+        workers (int, optional): Number of batches tagged concurrently. The
+            default is 1.
+        max_wait (float, optional): Seconds to wait for more requests. The
+            default is 0.01.
+        max_tokens (int, optional): Maximum tokens in a batch. The default is
+            5000.
+    """
+
+    def __init__(self, evaluator, workers=1, max_wait=0.01, max_tokens=5000):
+        self.evaluator = evaluator
+        self.max_wait = max_wait
+        self.max_tokens = max_tokens
+        self._requests = queue.Queue()
+        self._workers = [threading.Thread(target=self._work, daemon=True)
+                         for _ in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def tag(self, tokens):
+        """Tags one list of tokens, blocking until its batch is done.
+
+        Return:
+            list<tuple<str>>: The rows of Evaluator.tag_list
+        """
+        future = Future()
+        self._requests.put((tokens, future))
+        return future.result()
+
+    def close(self):
+        """Stops the workers once the pending requests are tagged."""
+        for _ in self._workers:
+            self._requests.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def _next_batch(self):
+        first = self._requests.get()
+        if first is None:
+            return None
+        batch = [first]
+        size = len(first[0])
+        while size < self.max_tokens:
+            try:
+                request = self._requests.get(timeout=self.max_wait)
+            except queue.Empty:
+                break
+            if request is None:
+                # Leave the stop signal for this worker's next round
+                self._requests.put(None)
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    def _work(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                results = self.evaluator.tag_batch(
+                    [tokens for tokens, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), rows in zip(batch, results):
+                    future.set_result(rows)
+
+
+class TagRequestHandler(BaseHTTPRequestHandler):
+    """Answers POST /tag requests whose JSON body holds either "tokens", a
+        list of tokens, or "text", raw text to tokenize. The response is a
+        JSON object with the "columns" and "rows" of Evaluator.tag_list.
+        Tokens must be non-empty and contain no whitespace.
+
+    Errors are answered with a JSON object holding the "error".
+    """
+
+    def do_POST(self):
+        if self.path != "/tag":
+            self._send_json(404, {"error": "Not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length).decode("utf-8"))
+            if "tokens" in request:
+                tokens = [str(token) for token in request["tokens"]]
+                # A bad token would fail the whole batch it joins
+                for token in tokens:
+                    if not token or any(c.isspace() for c in token):
+                        raise ValueError("Invalid token: {!r}".format(token))
+            else:
+                tokens = split_words(request["text"])
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        try:
+            rows = self.server.batcher.tag(tokens)
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+            return
+        self._send_json(200, {
+            "columns": self.server.batcher.evaluator.columns(),
+            "rows": rows})
+
+    def _send_json(self, code, response):
+        # The status line keeps the standard reason phrase, as it must be
+        # latin-1; the body is ASCII with any other text escaped
+        body = json.dumps(response).encode("ascii")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class TagServer(ThreadingMixIn, HTTPServer):
+    """HTTP server tagging requests with warm models.
+
+    Args:
+        address (tuple<str, int>): Host and port to listen on
+        batcher (TagBatcher): Batches the requests
+        verbose (bool, optional): Log every request. The default is False.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, batcher, verbose=False):
+        super().__init__(address, TagRequestHandler)
+        self.batcher = batcher
+        self.verbose = verbose
+
+
+def serve(evaluator, port, host="localhost", workers=1, max_wait=0.01,
+          verbose=False):
+    """Serves tagging requests until interrupted.
+
+    Args:
+        evaluator (Evaluator): The loaded models
+        port (int): Port to listen on
+        host (str, optional): Host to listen on. The default is "localhost".
+        workers (int, optional): See TagBatcher
+        max_wait (float, optional): See TagBatcher
+        verbose (bool, optional): Log every request. The default is False.
+    """
+    batcher = TagBatcher(evaluator, workers, max_wait)
+    server = TagServer((host, port), batcher, verbose)
+    print("Serving on http://{}:{}/tag".format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
@@ -0,0 +1,40 @@
+import random
+from collections import Counter, defaultdict
+
+import pytest
+
+import cngram
+
+_cngram = pytest.importorskip("_cngram")
+
+
+def random_words(rng, alphabet, num_words):
+    return ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+            for _ in range(num_words)]
+
+
+BMP = "abcdeñáé ü中文"
+ASTRAL = "ab\U0001F600\U0001F680\U00010348é"
+
+
+@pytest.mark.parametrize("alphabet", [BMP, ASTRAL], ids=["bmp", "astral"])
+@pytest.mark.parametrize("n", range(1, 8))
+def test_kernel_matches_python(monkeypatch, alphabet, n):
+    words = random_words(random.Random(n), alphabet, 500)
+
+    kernel = defaultdict(Counter)
+    _cngram.count_ngrams(kernel, words, n)
+    monkeypatch.setattr(cngram, "count_ngrams", None)
+    python = cngram.get_cond_cnts(words, n)
+
+    assert kernel == python
+    assert list(kernel) == list(python)
+    for ctx in python:
+        assert list(kernel[ctx].items()) == list(python[ctx].items())
+
+
+def test_kernel_adds_to_counts():
+    cond_cnts = defaultdict(Counter)
+    _cngram.count_ngrams(cond_cnts, ["ab"], 2)
+    _cngram.count_ngrams(cond_cnts, ["ab"], 2)
+    assert cond_cnts["a"]["b"] == 2
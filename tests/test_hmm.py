@@ -0,0 +1,70 @@
+import itertools
+import math
+import random
+
+import pytest
+
+from hmm import HiddenMarkovModel
+
+
+class StubCodeSModel:
+    """Emission scores looked up from a fixed table."""
+
+    def __init__(self, langs, scores):
+        self.langs = tuple(langs)
+        self.scores = scores
+
+    def probs(self, word):
+        return self.scores[word]
+
+    def prob(self, lang, word):
+        return self.scores[word][self.langs.index(lang)]
+
+
+def path_score(words, path, tags, transi_matrix, cs_model):
+    score = -math.log(len(tags)) + cs_model.prob(path[0], words[0])
+    for prev, tag, word in zip(path, path[1:], words[1:]):
+        score += transi_matrix[prev].get(tag, float("-inf"))
+        score += cs_model.prob(tag, word)
+    return score
+
+
+def brute_force(words, tags, transi_matrix, cs_model):
+    return max(path_score(words, path, tags, transi_matrix, cs_model)
+               for path in itertools.product(tags, repeat=len(words)))
+
+
+def random_case(rng, num_tags, num_words):
+    tags = ["T{}".format(k) for k in range(num_tags)]
+    transi_matrix = {}
+    for prev in tags:
+        # Self-transitions stay possible, others may be missing (-inf)
+        transi_matrix[prev] = {tag: math.log(rng.random())
+                               for tag in tags
+                               if tag == prev or rng.random() < 0.7}
+    words = ["w{}".format(i) for i in range(num_words)]
+    # The model may know more languages, in another order
+    langs = list(reversed(tags)) + ["Other"]
+    scores = {word: tuple(-rng.random() * 20 for _ in langs)
+              for word in words}
+    return words, tags, transi_matrix, StubCodeSModel(langs, scores)
+
+
+@pytest.mark.parametrize("num_tags", [1, 2, 3])
+@pytest.mark.parametrize("num_words", [1, 2, 3, 4, 5, 6])
+def test_viterbi_matches_brute_force(num_tags, num_words):
+    rng = random.Random(num_tags * 100 + num_words)
+    for _ in range(20):
+        words, tags, transi_matrix, cs_model = random_case(
+            rng, num_tags, num_words)
+        path = HiddenMarkovModel(words, tags, transi_matrix,
+                                 cs_model).gen_tags()
+        assert len(path) == len(words)
+        assert path_score(words, path, tags, transi_matrix, cs_model) == \
+            pytest.approx(brute_force(words, tags, transi_matrix, cs_model))
+
+
+def test_viterbi_without_words():
+    hmm = HiddenMarkovModel([], ["A", "B"], {"A": {}, "B": {}},
+                            StubCodeSModel(["A", "B"], {}))
+    assert hmm.gen_tags() == []
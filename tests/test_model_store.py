@@ -0,0 +1,52 @@
+import os
+import random
+
+import model_store
+from cngram import CNGram
+
+
+def random_words(seed, num_words=2000):
+    rng = random.Random(seed)
+    return ["".join(rng.choice("abcdeñé") for _ in range(rng.randint(1, 8)))
+            for _ in range(num_words)]
+
+
+def test_updates_are_merged_when_loaded(tmp_path):
+    path = str(tmp_path / "Lang.cngram")
+    model = CNGram("Lang", random_words(0), n=4, storage="compact")
+    model.save(path)
+    model.update(random_words(1), path=path)
+
+    store = str(tmp_path / "store")
+    model_store.load("set", [path], store=store)
+    (attached,), lexicon = model_store.attach("set", store=store)
+
+    assert lexicon is None
+    assert attached.updates == 0
+    assert type(attached.cond_cnts).__name__ == "PackedCondProbs"
+    for word in random_words(2, 200):
+        assert attached.word_prob(word) == model.word_prob(word)
+
+
+def test_reload_swaps_the_set(tmp_path):
+    paths = []
+    for k in range(2):
+        paths.append(str(tmp_path / "Lang{}.cngram".format(k)))
+        CNGram("Lang", random_words(k), n=3).save(paths[-1])
+
+    store = str(tmp_path / "store")
+    model_store.load("set", paths[:1], store=store)
+    (first,), _ = model_store.attach("set", store=store)
+    model_store.load("set", paths[1:], store=store)
+    (second,), _ = model_store.attach("set", store=store)
+
+    assert os.path.islink(os.path.join(store, "set"))
+    assert [manifest["name"] for manifest in model_store.resident(store)] \
+        == ["set"]
+    assert len(os.listdir(store)) == 2
+    word = "abcé"
+    assert first.word_prob(word) == CNGram.load(paths[0]).word_prob(word)
+    assert second.word_prob(word) == CNGram.load(paths[1]).word_prob(word)
+
+    model_store.unload("set", store=store)
+    assert os.listdir(store) == []
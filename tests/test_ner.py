@@ -0,0 +1,87 @@
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ner import NERClient
+
+
+class StubNERHandler(socketserver.StreamRequestHandler):
+    """Speaks the Stanford NER server protocol: one line of whitespace
+        separated tokens in, the tokens in slashTags format out. Capitalized
+        tokens are tagged PERSON."""
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            tokens = self.rfile.readline().decode("utf-8").split()
+            time.sleep(server.delay)
+            tags = ["{}/{}".format(token, "PERSON" if token[:1].isupper()
+                                   else "O") for token in tokens]
+            if server.drop_last:
+                tags = tags[:-1]
+            self.wfile.write((" ".join(tags) + "\n").encode("utf-8"))
+        finally:
+            with server.lock:
+                server.active -= 1
+
+
+class StubNERServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self, delay=0.0, drop_last=False):
+        super().__init__(("localhost", 0), StubNERHandler)
+        self.delay = delay
+        self.drop_last = drop_last
+        self.lock = threading.Lock()
+        self.active = self.max_active = 0
+
+
+@pytest.fixture
+def stub_server(request):
+    server = StubNERServer(**getattr(request, "param", {}))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def client_of(server, **kwargs):
+    host, port = server.server_address
+    return NERClient(host, port, **kwargs)
+
+
+def test_tag_round_trip(stub_server):
+    tokens = ["Juan", "went", "to", "México", "a/b", "."]
+    assert client_of(stub_server).tag(tokens) == [
+        ("Juan", "PERSON"), ("went", "O"), ("to", "O"),
+        ("México", "PERSON"), ("a/b", "O"), (".", "O")]
+
+
+def test_tag_empty_input(stub_server):
+    assert client_of(stub_server).tag([]) == []
+    assert stub_server.max_active == 0
+
+
+@pytest.mark.parametrize("stub_server", [{"drop_last": True}],
+                         indirect=True)
+def test_tag_count_mismatch(stub_server):
+    with pytest.raises(RuntimeError):
+        client_of(stub_server).tag(["one", "two"])
+
+
+@pytest.mark.parametrize("stub_server", [{"delay": 0.05}], indirect=True)
+def test_concurrent_calls_limited(stub_server):
+    client = client_of(stub_server, max_connections=2)
+    batches = [["Token{}".format(k), "x"] for k in range(8)]
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(client.tag, batches))
+    assert [[tag for _, tag in result] for result in results] == \
+        [["PERSON", "O"]] * 8
+    assert stub_server.max_active == 2
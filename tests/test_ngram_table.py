@@ -0,0 +1,92 @@
+import random
+
+import pytest
+
+from cngram import CNGram, hashed_storage
+from ngram_table import HEADER, VERSION
+
+
+def random_words(seed, alphabet="abcdeñáéü", num_words=2000):
+    rng = random.Random(seed)
+    return ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 8)))
+            for _ in range(num_words)]
+
+
+PROBES = random_words(99, "abcdeñáéüxyz", 300)
+
+
+@pytest.mark.parametrize("storage",
+                         ["dict", "compact", "q16", "q8", "h12", "h10c3"])
+def test_save_load_round_trip(tmp_path, storage):
+    model = CNGram("Lang", random_words(0), n=4, storage=storage)
+    path = str(tmp_path / "model.cngram")
+    model.save(path)
+    loaded = CNGram.load(path)
+
+    assert (loaded.lang, loaded.n, loaded.num_letters) == ("Lang", 4, 26)
+    assert len(loaded.cond_cnts) == len(model.cond_cnts)
+    for word in PROBES:
+        assert loaded.word_prob(word) == model.word_prob(word)
+
+
+@pytest.mark.parametrize("storage", ["h0", "h12c0", "h32", "h31c2"])
+def test_invalid_hashed_storage(storage):
+    with pytest.raises(ValueError):
+        hashed_storage(storage)
+
+
+def corrupt_header(path, **fields):
+    with open(path, mode="rb") as f:
+        data = f.read()
+    names = ["magic", "version", "byteorder", "bits", "n", "num_letters",
+             "num_ctx", "num_entries", "levels", "name_len"]
+    values = dict(zip(names, HEADER.unpack_from(data, 0)), **fields)
+    with open(path, mode="wb") as f:
+        f.write(HEADER.pack(*(values[name] for name in names)))
+        f.write(data[HEADER.size:])
+
+
+@pytest.mark.parametrize("fields", [{"magic": b"XXXX"},
+                                    {"version": VERSION + 1}],
+                         ids=["magic", "version"])
+def test_load_rejects_bad_header(tmp_path, fields):
+    path = str(tmp_path / "model.cngram")
+    CNGram("Lang", random_words(0), n=3).save(path)
+    corrupt_header(path, **fields)
+    with pytest.raises(ValueError):
+        CNGram.load(path)
+
+
+def test_appended_updates_load_like_a_rewritten_file(tmp_path):
+    first, second, third = (random_words(seed) for seed in (1, 2, 3))
+    path = str(tmp_path / "updated.cngram")
+    model = CNGram("Lang", first, n=4)
+    model.save(path)
+    model.update(second, path=path)
+    model.update(third, path=path)
+
+    rewritten = str(tmp_path / "rewritten.cngram")
+    CNGram("Lang", first + second + third, n=4).save(rewritten)
+    updated, scratch = CNGram.load(path), CNGram.load(rewritten)
+
+    assert updated.updates == 2
+    assert sorted(updated.cond_cnts) == sorted(scratch.cond_cnts)
+    for ctx in scratch.cond_cnts:
+        assert dict(updated.cond_cnts.row_counts(ctx)) == \
+            dict(scratch.cond_cnts.row_counts(ctx))
+    for word in PROBES:
+        assert updated.word_prob(word) == pytest.approx(scratch.word_prob(word))
+
+
+@pytest.mark.parametrize("cut", [4, 12, 100])
+def test_truncated_update_segment_is_rejected(tmp_path, cut):
+    path = str(tmp_path / "model.cngram")
+    model = CNGram("Lang", random_words(1), n=3)
+    model.save(path)
+    model.update(random_words(2), path=path)
+    with open(path, mode="rb") as f:
+        data = f.read()
+    with open(path, mode="wb") as f:
+        f.write(data[:-cut])
+    with pytest.raises(ValueError, match="truncated"):
+        CNGram.load(path)
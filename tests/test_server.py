@@ -0,0 +1,67 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from server import TagBatcher, TagServer
+
+
+class StubEvaluator:
+    """Tags every token as Lang, or fails on the token "fail"."""
+
+    def columns(self):
+        return ["Token", "Language"]
+
+    def tag_batch(self, word_lists):
+        if any("fail" in words for words in word_lists):
+            raise RuntimeError("tagging failed on «fail» 😀")
+        return [[(word, "Lang") for word in words] for words in word_lists]
+
+
+@pytest.fixture
+def url():
+    batcher = TagBatcher(StubEvaluator(), max_wait=0.001)
+    server = TagServer(("localhost", 0), batcher)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://localhost:{}/tag".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+    batcher.close()
+
+
+def post(url, body):
+    request = urllib.request.Request(url, data=json.dumps(body).encode(),
+                                     method="POST")
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.loads(response.read().decode())
+    except urllib.error.HTTPError as e:
+        assert e.headers["Content-Type"] == "application/json"
+        return e.code, json.loads(e.read().decode())
+
+
+def test_tag_tokens(url):
+    assert post(url, {"tokens": ["中", "文"]}) == (
+        200, {"columns": ["Token", "Language"],
+              "rows": [["中", "Lang"], ["文", "Lang"]]})
+
+
+@pytest.mark.parametrize("token", ["", "hola 😀", "中 文", "señor año"])
+def test_invalid_token(url, token):
+    code, response = post(url, {"tokens": ["ok", token]})
+    assert code == 400
+    assert repr(token) in response["error"]
+
+
+def test_bad_request(url):
+    code, response = post(url, {"words": []})
+    assert code == 400 and "error" in response
+
+
+def test_tagging_error(url):
+    code, response = post(url, {"tokens": ["fail"]})
+    assert code == 500
+    assert response["error"] == "tagging failed on «fail» 😀"
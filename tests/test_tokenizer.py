@@ -0,0 +1,39 @@
+import io
+import random
+
+import pytest
+
+from tokenizer import PUNCT, WORD, iter_tokens
+
+
+@pytest.mark.parametrize("alphabet", ["ab c\n", "ab,.", "中文,", "ab1 2."],
+                         ids=["spaces", "no-whitespace", "cjk", "numbers"])
+@pytest.mark.parametrize("block_size", [1, 3, 16, 1 << 16])
+def test_blocks_match_whole_text(alphabet, block_size):
+    rng = random.Random(block_size)
+    text = "".join(rng.choice(alphabet) for _ in range(2000))
+    whole = list(iter_tokens(text))
+    tokens = list(iter_tokens(io.StringIO(text), block_size))
+
+    assert all(text[token.start:token.end] == token.text for token in tokens)
+    if max(len(token.text) for token in whole) < block_size:
+        assert tokens == whole
+    else:
+        assert "".join(t.text for t in tokens) == \
+            "".join(t.text for t in whole)
+
+
+def test_long_text_without_whitespace():
+    text = "abc,def." * 100000
+    tokens = list(iter_tokens(io.StringIO(text), block_size=1000))
+    assert tokens == list(iter_tokens(text))
+    assert [token.kind for token in tokens[:4]] == [WORD, PUNCT, WORD, PUNCT]
+
+
+def test_long_word_is_split():
+    text = "中文" * 5000 + " end"
+    tokens = list(iter_tokens(io.StringIO(text), block_size=1000))
+    assert all(len(token.text) < 2000 for token in tokens)
+    assert all(text[token.start:token.end] == token.text for token in tokens)
+    assert "".join(token.text for token in tokens) == text.replace(" ", "")
+    assert tokens[-1].text == "end"
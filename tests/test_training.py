@@ -0,0 +1,84 @@
+import os
+import random
+
+import pytest
+
+from cngram import CNGram
+from tokenizer import split_words
+from tokenizer import iter_words
+from training import shard_ranges, train_models, update_model
+
+
+def write_corpus(path, alphabet, num_words, seed):
+    rng = random.Random(seed)
+    words = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 9)))
+             for _ in range(num_words)]
+    lines = [" ".join(words[i:i + 12]) for i in range(0, num_words, 12)]
+    with open(path, mode="w", encoding="utf-8") as out:
+        out.write("\n".join(lines) + "\n")
+
+
+def test_shard_ranges_cover_the_file(tmp_path):
+    path = str(tmp_path / "corpus.txt")
+    write_corpus(path, "abcñé", 500, 0)
+    ranges = shard_ranges(path, 5)
+    assert ranges[0][0] == 0 and ranges[-1][1] == os.path.getsize(path)
+    assert all(end == start for (_, end), (start, _) in zip(ranges,
+                                                            ranges[1:]))
+
+
+def test_parallel_training_matches_serial(tmp_path):
+    corpora = []
+    for k, alphabet in enumerate(["etaoinshrdlcu", "eaosrnidlñáéíóú"]):
+        path = str(tmp_path / "lang{}.txt".format(k))
+        write_corpus(path, alphabet, 2000, k)
+        corpora.append(("Lang{}".format(k), path))
+
+    parallel = train_models(corpora, n=5, workers=2, shards_per_corpus=5)
+
+    for (lang, path), model in zip(corpora, parallel):
+        with open(path, encoding="utf-8") as corpus:
+            serial = CNGram(lang, split_words(corpus.read()), n=5)
+        assert model.cond_cnts == serial.cond_cnts
+        assert model.cond_cnts.counts == serial.cond_cnts.counts
+
+        serial_path = str(tmp_path / (lang + "-serial.cngram"))
+        parallel_path = str(tmp_path / (lang + "-parallel.cngram"))
+        serial.save(serial_path)
+        model.save(parallel_path)
+        with open(serial_path, mode="rb") as a, \
+                open(parallel_path, mode="rb") as b:
+            assert a.read() == b.read()
+
+
+@pytest.mark.parametrize("storage", ["h12", "h10c3"])
+def test_parallel_hashed_training_matches_serial(tmp_path, storage):
+    path = str(tmp_path / "lang.txt")
+    write_corpus(path, "etaoinshrdlcu", 2000, 0)
+
+    model, = train_models([("Lang", path)], n=4, storage=storage, workers=2)
+    with open(path, encoding="utf-8") as corpus:
+        serial = CNGram("Lang", split_words(corpus.read()), n=4,
+                        storage=storage)
+    assert model.cond_cnts.types == serial.cond_cnts.types
+    assert model.cond_cnts.counts == serial.cond_cnts.counts
+
+
+def test_update_hashed_model(tmp_path):
+    first, second = str(tmp_path / "first.txt"), str(tmp_path / "second.txt")
+    write_corpus(first, "etaoinshrdlcu", 1000, 0)
+    write_corpus(second, "etaoinshrdlcu", 1000, 1)
+    model_path = str(tmp_path / "model.cngram")
+    with open(first, encoding="utf-8") as corpus:
+        CNGram("Lang", iter_words(corpus), n=4, storage="h12").save(
+            model_path)
+
+    update_model(model_path, [second], workers=2)
+    words = []
+    for path in (first, second):
+        with open(path, encoding="utf-8") as corpus:
+            words.extend(split_words(corpus.read()))
+    whole = CNGram("Lang", words, n=4, storage="h12")
+    updated = CNGram.load(model_path)
+    assert updated.cond_cnts.types == whole.cond_cnts.types
+    assert updated.cond_cnts.counts == whole.cond_cnts.counts
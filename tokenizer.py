@@ -0,0 +1,110 @@
+#  tokenizer.py
+#  Using Python 3.4.3
+
+import re
+from collections import namedtuple
+
+
+"""Token kinds. PUNCT and NUM double as the language tags given to
+    punctuation and numbers."""
+WORD = "Word"
+PUNCT = "Punct"
+NUM = "Num"
+
+"""A run of word characters, or a single character that is neither a word
+    character nor whitespace. TOKEN captures which of the two matched."""
+WORDS = re.compile(r'\w+|[^\s\w]')
+TOKEN = re.compile(r'(\w+)|([^\s\w])')
+WORD_CHAR = re.compile(r'\w')
+
+"""Punctuation as recognized in tokens that did not come from this module,
+    e.g. multi-character punctuation in a gold standard."""
+PUNCT_START = re.compile(r'[^\w\s]')
+
+"""A token with its character offsets [start, end) in the source and its
+    kind (WORD, PUNCT or NUM)."""
+Token = namedtuple("Token", ["text", "start", "end", "kind"])
+
+
+def split_words(text, keep_case=True):
+    """Splits a string of white-space separated words into tokens of words
+
+    Args:
+        text (str): String containing all words
+        keep_case (bool, optional): Determine if the case of the letters
+            is maintained. Defaults to True.
+
+    Returns:
+        list<str>: List of all the tokens within the text
+    """
+    if not keep_case:
+        text = text.lower()
+    return WORDS.findall(text)
+
+
+def classify(word):
+    """Return the kind of a token that did not come from iter_tokens.
+
+    Args:
+        word (str): The token
+
+    Returns:
+        str: PUNCT, NUM or WORD
+    """
+    if PUNCT_START.match(word) and not word[-1].isalpha():
+        return PUNCT
+    if word.isdigit():
+        return NUM
+    return WORD
+
+
+def _tokens(text, base):
+    for match in TOKEN.finditer(text):
+        word = match.group()
+        if match.lastindex == 2:
+            kind = PUNCT
+        elif word.isdigit():
+            kind = NUM
+        else:
+            kind = WORD
+        yield Token(word, base + match.start(), base + match.end(), kind)
+
+
+def iter_tokens(source, block_size=1 << 16):
+    """Lazily tokenizes a string or a text file, reading files in blocks.
+    A block is only tokenized up to the end of its last character that is
+        not a word character, so no token is split across two blocks. Only
+        a run of block_size or more word characters, which would otherwise
+        be held in memory whole, is split into several tokens.
+
+    Args:
+        source (str or file): Text, or an open text file
+        block_size (int, optional): Number of characters read at a time
+
+    Yields:
+        Token: The tokens within the text, in order, with their character
+            offsets and kinds
+    """
+    if isinstance(source, str):
+        yield from _tokens(source, 0)
+        return
+
+    base = 0
+    tail = ""
+    for block in iter(lambda: source.read(block_size), ""):
+        text = tail + block
+        cut = len(text)
+        limit = cut - block_size
+        while cut > 0 and cut > limit and WORD_CHAR.match(text, cut - 1):
+            cut -= 1
+        if cut <= limit:
+            cut = len(text)
+        yield from _tokens(text[:cut], base)
+        base += cut
+        tail = text[cut:]
+    yield from _tokens(tail, base)
+
+
+def iter_words(source, block_size=1 << 16):
+    """Like iter_tokens, but yields only the text of each token."""
+    return (token.text for token in iter_tokens(source, block_size))
@@ -0,0 +1,203 @@
+#  training.py
+#  Using Python 3.4.3
+
+import os
+import re
+import time
+import argparse
+from collections import defaultdict, Counter
+from concurrent.futures import ProcessPoolExecutor
+from cngram import CNGram, get_cond_cnts, hashed_storage, merge_cond_cnts
+from ngram_table import HashedCondProbs, append_counts
+from tokenizer import iter_words, split_words
+
+
+WHITESPACE = re.compile(rb"[ \t\n\r\f\v]")
+
+
+def shard_ranges(path, num_shards):
+    """Splits a UTF-8 file into byte ranges of roughly equal size. Every
+        boundary is moved forward to an ASCII whitespace byte, which never
+        occurs inside a multi-byte character or a token, so tokenizing the
+        shards separately yields exactly the tokens of the whole file.
+
+    Args:
+        path (str): path to the corpus
+        num_shards (int): desired number of shards
+
+    Return:
+        list<tuple<int, int>>: (start, end) byte offsets covering the file
+    """
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, mode="rb") as corpus:
+        for k in range(1, num_shards):
+            pos = max(size * k // num_shards, bounds[-1])
+            corpus.seek(pos)
+            while pos < size:
+                block = corpus.read(1 << 12)
+                hit = WHITESPACE.search(block)
+                if hit:
+                    pos += hit.start()
+                    break
+                pos += len(block)
+            bounds.append(min(pos, size))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:])
+            if start < end]
+
+
+def count_shard(path, start, end, n):
+    """Counts the n-grams of the tokens in one byte range of a corpus.
+
+    Return:
+        defaultdict<str, Counter>: see get_cond_cnts
+    """
+    with open(path, mode="rb") as corpus:
+        corpus.seek(start)
+        text = corpus.read(end - start).decode("utf-8")
+    return get_cond_cnts(split_words(text), n)
+
+
+def count_hashed(path, n, num_letters, storage):
+    """Counts the n-grams of a whole corpus straight into a hashed table,
+        streaming the file, so that memory does not grow with the corpus.
+
+    Return:
+        HashedCondProbs: the table
+    """
+    table = HashedCondProbs(*hashed_storage(storage), num_letters=num_letters)
+    with open(path, mode="r", encoding="utf-8") as corpus:
+        table.add_words(iter_words(corpus), n)
+    return table
+
+
+def train_models(corpora, n=5, num_letters=26, storage="dict", workers=None,
+                 shards_per_corpus=None):
+    """Trains one n-gram model per language in parallel. Each corpus is
+        split into byte ranges whose n-grams are counted in a process pool;
+        the partial counts of a language are merged before normalization.
+        All languages are counted concurrently. The resulting models are
+        identical to those trained serially with CNGram.
+
+    Hashed tables count the distinct last characters of their contexts,
+        which cannot be merged across shards; with a hashed storage, each
+        corpus is streamed into its table by one process instead.
+
+    Args:
+        corpora (list<tuple<str, str>>): (language, corpus path) pairs
+        n (int, optional): length of the n-grams. The default is 5.
+        num_letters (int, optional): see CNGram. The default is 26.
+        storage (str, optional): see CNGram. The default is "dict".
+        workers (int, optional): number of processes. Defaults to the number
+            of CPUs.
+        shards_per_corpus (int, optional): number of byte ranges per corpus.
+            Defaults to the number of workers.
+
+    Return:
+        list<CNGram>: the models, in the order of corpora
+    """
+    workers = workers or os.cpu_count() or 1
+    shards_per_corpus = shards_per_corpus or workers
+
+    if hashed_storage(storage) is not None:
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(count_hashed, path, n, num_letters,
+                                   storage)
+                       for _, path in corpora]
+            return [CNGram.from_counts(lang, future.result(), num_letters, n,
+                                       storage)
+                    for (lang, _), future in zip(corpora, futures)]
+
+    with ProcessPoolExecutor(workers) as pool:
+        pending = [[pool.submit(count_shard, path, start, end, n)
+                    for start, end in shard_ranges(path, shards_per_corpus)]
+                   for _, path in corpora]
+
+        models = []
+        for (lang, _), futures in zip(corpora, pending):
+            cond_cnts = defaultdict(Counter)
+            for future in futures:
+                merge_cond_cnts(cond_cnts, future.result())
+            models.append(CNGram.from_counts(lang, cond_cnts, num_letters, n,
+                                             storage))
+    return models
+
+
+def update_model(model_path, paths, workers=None, compact=False):
+    """Adds new training text to a stored model. The n-grams of the new
+        text are counted in parallel like in train_models and appended to
+        the model file, leaving the table already in it untouched.
+
+    Hashed models are updated by streaming the new text straight into their
+        table, which is then rewritten, as compact would.
+
+    Args:
+        model_path (str): model file written by CNGram.save
+        paths (list<str>): corpus files of new text
+        workers (int, optional): number of processes. Defaults to the number
+            of CPUs.
+        compact (bool, optional): rewrite the model file with the new counts
+            merged into its table, instead of appending them. The default is
+            False.
+
+    Return:
+        CNGram: the updated model
+    """
+    model = CNGram.load(model_path)
+    if isinstance(model.cond_cnts, HashedCondProbs):
+        for path in paths:
+            with open(path, mode="r", encoding="utf-8") as corpus:
+                model.update_words(iter_words(corpus))
+        model.save(model_path)
+        return model
+    workers = workers or os.cpu_count() or 1
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(count_shard, path, start, end, model.n)
+                   for path in paths
+                   for start, end in shard_ranges(path, workers)]
+        cond_cnts = defaultdict(Counter)
+        for future in futures:
+            merge_cond_cnts(cond_cnts, future.result())
+
+    model.update_counts(cond_cnts)
+    if compact:
+        model.save(model_path)
+    else:
+        append_counts(model_path, cond_cnts)
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Add new training text to a stored language model")
+    parser.add_argument(
+            "model",
+            type=str,
+            help="model file in the model directory")
+    parser.add_argument(
+            "corpus",
+            nargs="+",
+            type=str,
+            help="corpus files of new text")
+    parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="number of counting processes (Default: number of CPUs)")
+    parser.add_argument(
+            "--compact",
+            action="store_true",
+            help="merge the appended counts into the table of the model file "
+                 "(Default: False)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    model = update_model(args.model, args.corpus, args.workers, args.compact)
+    print("Updated {} ({} contexts) in {:.2f}s".format(
+        args.model, len(model.cond_cnts), time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()